@@ -0,0 +1,269 @@
+"""
+Benchmarks for the middleware, geolocation and detection hot paths.
+
+Run through the run_benchmarks management command, which creates a throwaway
+test database first. Geolocation providers are replaced by a stub, so
+nothing here touches the network. Every function returns a list of result
+dicts that serialise straight to JSON.
+"""
+import ipaddress
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, override_settings
+from django.conf import settings
+from django.utils import timezone
+
+from .blocklist import blocklist_index, bump_blocklist_version
+from .geolocation import GeolocationService, geolocation_cache
+from .log_writer import request_log_writer
+from .middleware import IPLoggingMiddleware
+from .models import BlockedIP, RequestLog, SuspiciousIP
+from .path_classifier import sensitive_path_matcher
+from .request_counters import rebuild_counters
+from .window_counters import window_counters
+from . import tasks
+from . import views
+
+SEED = 1234
+STUB_LOCATION = {
+    'country': 'Benchmarkland',
+    'country_code': 'BM',
+    'city': 'Stub City',
+    'region': 'Stub Region',
+    'latitude': 0.0,
+    'longitude': 0.0,
+}
+
+
+def summarize(name, samples, **params):
+    """Result dict for per-call samples in seconds, reported in microseconds"""
+    ordered = sorted(samples)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1e6
+
+    return {
+        'name': name,
+        'params': params,
+        'unit': 'us',
+        'iterations': len(ordered),
+        'mean': statistics.fmean(ordered) * 1e6,
+        'min': ordered[0] * 1e6,
+        'p50': percentile(0.50),
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': ordered[-1] * 1e6,
+    }
+
+
+def measure(fn, iterations, before=None):
+    """Time iterations calls of fn(i); before(i), if given, runs outside the timer"""
+    samples = []
+    for i in range(iterations):
+        if before is not None:
+            before(i)
+        started = time.perf_counter()
+        fn(i)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def time_once(name, fn, repeat=3, **params):
+    """Result dict for a slow operation run repeat times, reported in seconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return {
+        'name': name,
+        'params': params,
+        'unit': 's',
+        'iterations': repeat,
+        'mean': statistics.fmean(samples),
+        'min': min(samples),
+        'p50': statistics.median(samples),
+        'max': max(samples),
+    }
+
+
+def truncate(model):
+    """Empty a table with one statement; QuerySet.delete() would fire per-row signals"""
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {connection.ops.quote_name(model._meta.db_table)}')
+
+
+def stub_geolocation_service(delay=0.0):
+    """GeolocationService whose only provider answers from memory after delay seconds"""
+    def _stub_service(ip_address):
+        if delay:
+            time.sleep(delay)
+        return dict(STUB_LOCATION, ip=ip_address)
+
+    service = GeolocationService()
+    service.services = [_stub_service]
+    service.batch_services = {}
+    return service
+
+
+def client_ips(count, rng):
+    """Distinct public IPv4 addresses in 11.0.0.0/8"""
+    base = int(ipaddress.IPv4Address('11.0.0.0'))
+    return [str(ipaddress.IPv4Address(base + value)) for value in rng.sample(range(1, 2 ** 24), count)]
+
+
+def grow_blocklist(target_size, rng, batch_size=5000):
+    """Add random BlockedIP rows (about 10% /24 networks) until target_size rows exist"""
+    missing = target_size - BlockedIP.objects.count()
+    while missing > 0:
+        rows = []
+        for _ in range(min(batch_size, missing)):
+            value = rng.getrandbits(32)
+            if rng.random() < 0.1:
+                rows.append(BlockedIP(ip_address=str(ipaddress.IPv4Address(value & ~0xFF)), prefix_length=24))
+            else:
+                rows.append(BlockedIP(ip_address=str(ipaddress.IPv4Address(value))))
+        BlockedIP.objects.bulk_create(rows, ignore_conflicts=True)
+        missing = target_size - BlockedIP.objects.count()
+    bump_blocklist_version()
+
+
+def bench_middleware(blocklist_sizes, iterations=2000, client_count=1000):
+    """Per-request IPLoggingMiddleware cost at each blocklist size, geolocation cached"""
+    rng = random.Random(SEED)
+    service = stub_geolocation_service()
+    ips = client_ips(client_count, rng)
+    service.get_geolocation_many(ips)
+
+    middleware = IPLoggingMiddleware(lambda request: HttpResponse('ok'))
+    middleware.geolocation_service = service
+    factory = RequestFactory()
+    paths = ['/', '/logs/', '/api/items', '/admin/login']
+    requests = [
+        factory.get(paths[i % len(paths)], REMOTE_ADDR=ips[i % len(ips)])
+        for i in range(iterations)
+    ]
+
+    results = []
+    for size in sorted(blocklist_sizes):
+        grow_blocklist(size, rng)
+        results.append(time_once('blocklist_index_load', blocklist_index.refresh, repeat=1, blocklist_entries=size))
+
+        dropped = request_log_writer.dropped
+        samples = measure(lambda i: middleware(requests[i]), iterations)
+        request_log_writer.flush()
+        result = summarize('middleware_request', samples, blocklist_entries=size)
+        result['log_rows_dropped'] = request_log_writer.dropped - dropped
+        results.append(result)
+    return results
+
+
+def bench_geolocation(iterations=2000):
+    """GeolocationService.get_geolocation on local hits, shared-cache hits and misses"""
+    rng = random.Random(SEED + 1)
+    service = stub_geolocation_service()
+    ips = client_ips(iterations * 2, rng)
+    warm, cold = ips[:iterations], ips[iterations:]
+    service.get_geolocation_many(warm)
+
+    def drop_local(i):
+        geolocation_cache.local.delete(service.cache_key(warm[i]))
+
+    return [
+        summarize('geolocation_local_hit', measure(lambda i: service.get_geolocation(warm[i]), iterations)),
+        summarize(
+            'geolocation_shared_hit',
+            measure(lambda i: service.get_geolocation(warm[i]), iterations, before=drop_local)
+        ),
+        summarize(
+            'geolocation_miss',
+            measure(lambda i: service.get_geolocation(cold[i]), iterations),
+            provider='stub'
+        ),
+    ]
+
+
+def grow_request_logs(target_rows, rng, batch_size=10000):
+    """
+    Add synthetic RequestLog rows from the last 50 minutes until target_rows exist.
+    IP popularity is skewed, so a few IPs cross the volume threshold, and
+    about 5% of requests hit sensitive paths. Rows are also recorded in the
+    process window counters, as the middleware would have done.
+    """
+    ip_count = max(10, target_rows // 50)
+    base = int(ipaddress.IPv4Address('11.0.0.0'))
+    prefixes = getattr(settings, 'ANOMALY_DETECTION', {}).get('SENSITIVE_PATHS') or ['/admin']
+    now = timezone.now()
+
+    missing = target_rows - RequestLog.objects.count()
+    while missing > 0:
+        rows = []
+        for _ in range(min(batch_size, missing)):
+            ip_address = str(ipaddress.IPv4Address(base + int(rng.random() ** 3 * ip_count)))
+            path = f"{rng.choice(prefixes)}/x" if rng.random() < 0.05 else f"/page/{rng.randrange(100)}"
+            category = sensitive_path_matcher.category(path)
+            country = rng.randrange(50)
+            rows.append(RequestLog(
+                ip_address=ip_address,
+                path=path,
+                timestamp=now - timedelta(seconds=rng.uniform(0, 3000)),
+                is_sensitive=category is not None,
+                sensitive_category=category,
+                country=f"Country {country}",
+                city=f"City {country}.{rng.randrange(10)}",
+            ))
+        RequestLog.objects.bulk_create(rows, batch_size=1000)
+        for row in rows:
+            window_counters.record(row.ip_address, row.path, row.is_sensitive)
+        missing -= len(rows)
+    window_counters.publish()
+
+
+def seed_repeat_offenders(count, rng):
+    """Three open SuspiciousIP records each for count IPs, for auto_block_suspicious_ips"""
+    base = int(ipaddress.IPv4Address('12.0.0.0'))
+    SuspiciousIP.objects.bulk_create([
+        SuspiciousIP(
+            ip_address=str(ipaddress.IPv4Address(base + rng.getrandbits(24))),
+            reason='high_volume',
+            request_count=500,
+            description='Benchmark repeat offender',
+        )
+        for _ in range(count)
+        for _ in range(3)
+    ], batch_size=1000)
+
+
+def bench_detection(row_counts, repeat=3, stats_iterations=50):
+    """Detection, auto-blocking and stats timings over RequestLog tables of each size"""
+    rng = random.Random(SEED + 2)
+    factory = RequestFactory()
+    detection = getattr(settings, 'ANOMALY_DETECTION', {})
+
+    for model in (RequestLog, SuspiciousIP, BlockedIP):
+        truncate(model)
+    bump_blocklist_version()
+
+    results = []
+    for rows in sorted(row_counts):
+        grow_request_logs(rows, rng)
+        seed_repeat_offenders(100, rng)
+
+        results.append(time_once('detect_suspicious_ips', tasks.detect_suspicious_ips, repeat, rows=rows, source='window'))
+        with override_settings(ANOMALY_DETECTION=dict(detection, WINDOW_COUNTERS=False)):
+            results.append(time_once('detect_suspicious_ips', tasks.detect_suspicious_ips, repeat, rows=rows, source='table'))
+        results.append(time_once('auto_block_suspicious_ips', tasks.auto_block_suspicious_ips, repeat, rows=rows))
+        results.append(time_once('rebuild_request_counters', rebuild_counters, repeat=1, rows=rows))
+
+        request = factory.get('/stats/')
+        results.append(summarize(
+            'geolocation_stats_view',
+            measure(lambda i: views.geolocation_stats(request), stats_iterations),
+            rows=rows
+        ))
+    return results
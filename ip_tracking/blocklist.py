@@ -0,0 +1,139 @@
+import ipaddress
+import threading
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .deferred import deferrable
+
+BLOCKLIST_VERSION_KEY = 'ip_blocklist_version'
+
+
+def get_blocklist_settings():
+    """Blocklist settings with defaults applied"""
+    config = {
+        'REFRESH_INTERVAL': 5,  # Seconds between version checks
+    }
+    config.update(getattr(settings, 'IP_BLOCKLIST', {}))
+    return config
+
+
+def parse_network(value):
+    """Parse an address or CIDR string into an ip_network (host bits not allowed)"""
+    network = ipaddress.ip_network(str(value).strip(), strict=True)
+    if network.version == 6 and network.prefixlen == 128 and network.network_address.ipv4_mapped:
+        network = ipaddress.ip_network(network.network_address.ipv4_mapped)
+    return network
+
+
+@deferrable
+def bump_blocklist_version():
+    """Tell every process that the blocklist changed so it reloads its index"""
+    cache.set(BLOCKLIST_VERSION_KEY, uuid.uuid4().hex, None)
+    blocklist_index.invalidate()
+
+
+class BlocklistIndex:
+    """
+    Per-process membership index over BlockedIP.
+
+    Networks are stored per address family as {prefix_length: {network >> host_bits}},
+    so a lookup is one shift and one set probe per distinct prefix length in use.
+    The index reloads from the database only when the shared version key changes,
+    and that key is read at most once per REFRESH_INTERVAL.
+    """
+
+    def __init__(self, refresh_interval=None):
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._tables = {4: {}, 6: {}}
+        self._version = None
+        self._loaded = False
+        self._checked_at = float('-inf')
+        self.size = 0
+
+    def load(self, networks):
+        """Replace the index contents with the given ip_network objects"""
+        tables = {4: {}, 6: {}}
+        size = 0
+        for network in networks:
+            host_bits = network.max_prefixlen - network.prefixlen
+            tables[network.version].setdefault(network.prefixlen, set()).add(
+                int(network.network_address) >> host_bits
+            )
+            size += 1
+        # Longest prefixes first: exact-address hits are the common case
+        self._tables = {
+            version: dict(sorted(table.items(), reverse=True))
+            for version, table in tables.items()
+        }
+        self.size = size
+
+    def load_from_db(self):
+        """Rebuild the index from the BlockedIP table"""
+        from .models import BlockedIP
+
+        networks = []
+        for ip_address, prefix_length in BlockedIP.objects.values_list('ip_address', 'prefix_length').iterator():
+            try:
+                networks.append(BlockedIP.to_network(ip_address, prefix_length))
+            except ValueError as e:
+                print(f"Skipping invalid blocklist entry {ip_address}/{prefix_length}: {e}")
+        self.load(networks)
+
+    def invalidate(self):
+        """Force a version check on the next lookup"""
+        self._checked_at = float('-inf')
+
+    def refresh_due(self):
+        """Whether the next lookup has to check the shared version first"""
+        interval = self.refresh_interval
+        if interval is None:
+            interval = get_blocklist_settings()['REFRESH_INTERVAL']
+        return not self._loaded or time.monotonic() - self._checked_at >= interval
+
+    def refresh(self):
+        """Reload from the database if the shared version changed"""
+        if not self.refresh_due():
+            return
+
+        with self._lock:
+            if not self.refresh_due():
+                return
+            version = cache.get(BLOCKLIST_VERSION_KEY)
+            if not self._loaded or version != self._version:
+                self.load_from_db()
+                self._version = version
+                self._loaded = True
+            self._checked_at = time.monotonic()
+
+    def contains(self, ip_address):
+        """Return True if the address is blocked exactly or by a covering network"""
+        self.refresh()
+        return self.lookup(ip_address)
+
+    async def acontains(self, ip_address):
+        """Async contains(); the cache and database work of a refresh runs in a thread"""
+        if self.refresh_due():
+            await sync_to_async(self.refresh)()
+        return self.lookup(ip_address)
+
+    def lookup(self, ip_address):
+        """Membership test against the loaded tables, without refreshing"""
+        address = ipaddress.ip_address(ip_address)
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        value = int(address)
+        max_prefixlen = address.max_prefixlen
+        for prefixlen, networks in self._tables[address.version].items():
+            if value >> (max_prefixlen - prefixlen) in networks:
+                return True
+        return False
+
+
+# Shared by the middleware and the BlockedIP signal handlers in this process
+blocklist_index = BlocklistIndex()
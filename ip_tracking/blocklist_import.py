@@ -0,0 +1,176 @@
+"""
+Bulk blocklist changes for the block_ip and unblock_ip commands.
+
+Entries are read as a stream of addresses and CIDRs, validated and
+deduplicated in batches, and written with one bulk_create or one delete per
+batch inside a transaction. Each operation bumps the blocklist version once
+when it is done, however many rows its signals touched.
+"""
+import time
+
+from django.db import transaction
+
+from .blocklist import bump_blocklist_version, parse_network
+from .log_import import open_log
+from .models import BlockedIP
+
+
+def read_values(values=(), files=()):
+    """
+    Raw entries from the arguments, then from each file ('-' is stdin, .gz
+    is decompressed). Blank lines and # comments are skipped; only the first
+    field of a line is used, so feeds with trailing columns can be read as is.
+    """
+    for value in values:
+        yield value
+    for path in files:
+        with open_log(path) as stream:
+            for line in stream:
+                fields = line.split('#', 1)[0].replace(',', ' ').split()
+                if fields:
+                    yield fields[0]
+
+
+def clean_batches(values, batch_size=5000, on_invalid=None):
+    """
+    Batches of (ip_address, prefix_length) entries from raw entries, as
+    BlockedIP.from_network stores them. Invalid entries are passed to
+    on_invalid(value, error) and left out.
+    """
+    batch = set()
+    for value in values:
+        try:
+            network = parse_network(value)
+        except ValueError as e:
+            if on_invalid is not None:
+                on_invalid(value, e)
+            continue
+        prefix_length = network.prefixlen if network.num_addresses > 1 else None
+        batch.add((str(network.network_address), prefix_length))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = set()
+    if batch:
+        yield batch
+
+
+def _stored(batch):
+    """(pk, ip_address, prefix_length) of the rows sharing an address with an entry in batch"""
+    return BlockedIP.objects.filter(
+        ip_address__in={ip_address for ip_address, _ in batch}
+    ).values_list('pk', 'ip_address', 'prefix_length')
+
+
+def _present(batch):
+    """The entries of batch that have a row"""
+    return {(ip_address, prefix_length) for _, ip_address, prefix_length in _stored(batch)} & batch
+
+
+def _create_missing(entries, existing, reason, batch_size):
+    """
+    Create a row for each entry not in existing; returns how many of them
+    have a row afterwards. bulk_create(ignore_conflicts=True) silently skips
+    rows it could not insert, so the stored rows are counted rather than the
+    rows sent.
+    """
+    missing = list(entries - existing)
+    rows = [
+        BlockedIP(ip_address=ip_address, prefix_length=prefix_length, reason=reason)
+        for ip_address, prefix_length in missing
+    ]
+    BlockedIP.objects.bulk_create(rows, batch_size=batch_size, ignore_conflicts=True)
+    return sum(
+        len(_present(set(missing[start:start + batch_size])))
+        for start in range(0, len(missing), batch_size)
+    )
+
+
+def _delete_pks(pks):
+    # Runs inside bump_blocklist_version.deferred(), so the per-row post_delete
+    # signals bump the version once
+    return BlockedIP.objects.filter(pk__in=pks).delete()[0]
+
+
+@bump_blocklist_version.deferred()
+def block_many(batches, reason=None, batch_size=5000):
+    """Add every entry not blocked yet; returns counts of created, existing and seen entries"""
+    stats = {'seen': 0, 'created': 0, 'existing': 0}
+    for batch in batches:
+        stats['seen'] += len(batch)
+        with transaction.atomic():
+            existing = _present(batch)
+            created = _create_missing(batch, existing, reason, batch_size)
+        stats['created'] += created
+        stats['existing'] += len(existing)
+    if stats['created']:
+        # bulk_create sends no post_save signals
+        bump_blocklist_version()
+    return stats
+
+
+@bump_blocklist_version.deferred()
+def unblock_many(batches):
+    """Delete the rows matching each entry, prefix length included; returns counts"""
+    stats = {'seen': 0, 'deleted': 0, 'not_found': 0}
+    for batch in batches:
+        stats['seen'] += len(batch)
+        with transaction.atomic():
+            pks = [
+                pk
+                for pk, ip_address, prefix_length in _stored(batch)
+                if (ip_address, prefix_length) in batch
+            ]
+            deleted = _delete_pks(pks) if pks else 0
+        stats['deleted'] += deleted
+        stats['not_found'] += len(batch) - deleted
+    return stats
+
+
+@bump_blocklist_version.deferred()
+def sync_blocklist(batches, reason=None, batch_size=5000, dry_run=False):
+    """
+    Make the blocklist exactly the given entries in one transaction: rows
+    missing from the input are deleted and new entries created. Only the
+    difference is written. Returns counts.
+    """
+    wanted = set()
+    for batch in batches:
+        wanted |= batch
+
+    stats = {'seen': len(wanted), 'created': 0, 'deleted': 0, 'unchanged': 0}
+    with transaction.atomic():
+        delete_pks = []
+        existing = set()
+        rows = BlockedIP.objects.values_list('pk', 'ip_address', 'prefix_length').iterator(chunk_size=batch_size)
+        for pk, ip_address, prefix_length in rows:
+            if (ip_address, prefix_length) in wanted:
+                existing.add((ip_address, prefix_length))
+            else:
+                delete_pks.append(pk)
+
+        stats['created'] = len(wanted - existing)
+        stats['deleted'] = len(delete_pks)
+        stats['unchanged'] = len(existing)
+        if dry_run:
+            return stats
+
+        for start in range(0, len(delete_pks), batch_size):
+            _delete_pks(delete_pks[start:start + batch_size])
+        stats['created'] = _create_missing(wanted, existing, reason, batch_size)
+
+    if stats['created']:
+        # bulk_create sends no post_save signals
+        bump_blocklist_version()
+    return stats
+
+
+class Throughput:
+    """Elapsed time and entries per second for a command's summary line"""
+
+    def __init__(self):
+        self.started = time.monotonic()
+
+    def report(self, count):
+        elapsed = time.monotonic() - self.started
+        rate = count / elapsed if elapsed > 0 else 0
+        return f'{count} entries in {elapsed:.2f}s ({rate:.0f}/s)'
@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+class CircuitBreaker:
+    """
+    Skips a failing dependency for a cool-down period.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and
+    ``allow()`` returns False for ``cooldown`` seconds. The next caller after
+    that is let through as a probe: a success closes the circuit, a failure
+    opens it again for another cool-down.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_threshold=5, cooldown=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.state = self.CLOSED
+        self.failures = 0
+        self.skipped = 0
+        self._changed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether a call may go through right now"""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            # An open circuit, or a probe that never reported back, is retried after the cool-down
+            if time.monotonic() - self._changed_at >= self.cooldown:
+                self.state = self.HALF_OPEN
+                self._changed_at = time.monotonic()
+                return True
+            self.skipped += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._changed_at = time.monotonic()
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._changed_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'skipped': self.skipped,
+            }
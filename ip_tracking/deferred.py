@@ -0,0 +1,34 @@
+import contextlib
+import functools
+import threading
+
+
+def deferrable(fn):
+    """
+    Wrap a no-argument invalidation function, such as a cache version bump,
+    so that calls made inside ``with fn.deferred():`` in the same thread
+    collapse into a single call when the outermost block exits. Bulk
+    operations use it to keep per-row signals from bumping once per row.
+    """
+    local = threading.local()
+
+    @functools.wraps(fn)
+    def call():
+        if getattr(local, 'depth', 0):
+            local.pending = True
+            return
+        fn()
+
+    @contextlib.contextmanager
+    def deferred():
+        local.depth = getattr(local, 'depth', 0) + 1
+        try:
+            yield
+        finally:
+            local.depth -= 1
+            if not local.depth and getattr(local, 'pending', False):
+                local.pending = False
+                fn()
+
+    call.deferred = deferred
+    return call
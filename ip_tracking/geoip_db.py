@@ -0,0 +1,285 @@
+"""
+Offline IP-range geolocation database.
+
+A CSV range table is compiled into a sorted binary file that is memory-mapped
+read-only, so every worker process on a host shares the same pages. Lookups
+are a binary search over fixed-width 16-byte keys (IPv4 is stored in its
+IPv4-mapped IPv6 form), so both families live in one sorted key space.
+
+File layout (little-endian header, big-endian keys):
+
+    header   magic, format version, record count
+    starts   count * 16 bytes, sorted ascending
+    ends     count * 16 bytes
+    records  count * (latitude, longitude, 6 string offsets)
+    strings  uint16 length-prefixed UTF-8 strings, deduplicated
+"""
+import csv
+import ipaddress
+import math
+import mmap
+import os
+import struct
+import threading
+import time
+
+MAGIC = b'IPGEODB\x00'
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct('<8sII')
+KEY_SIZE = 16
+RECORD = struct.Struct('<dd6I')
+STRING_LENGTH = struct.Struct('<H')
+NO_STRING = 0xFFFFFFFF
+
+CSV_COLUMNS = [
+    'start_ip', 'end_ip', 'country', 'country_code', 'city', 'region',
+    'latitude', 'longitude', 'timezone', 'isp',
+]
+STRING_FIELDS = ['country', 'country_code', 'city', 'region', 'timezone', 'isp']
+REQUIRED_COLUMNS = ['start_ip', 'end_ip', 'country']
+
+
+class GeoIPDatabaseError(Exception):
+    pass
+
+
+def ip_to_key(ip_address):
+    """Pack an address into the 16-byte big-endian key used by the file"""
+    address = ipaddress.ip_address(ip_address)
+    if address.version == 4:
+        address = ipaddress.IPv6Address(f'::ffff:{address}')
+    return address.packed
+
+
+def _parse_coordinate(value, limit, name):
+    if value in (None, ''):
+        return math.nan
+    number = float(value)
+    if not -limit <= number <= limit:
+        raise ValueError(f'{name} out of range: {value}')
+    return number
+
+
+def read_csv_ranges(csv_path):
+    """Yield validated range rows from a CSV file with a header line"""
+    with open(csv_path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise GeoIPDatabaseError(f"Missing CSV columns: {', '.join(missing)}")
+
+        for line_number, row in enumerate(reader, start=2):
+            try:
+                start = ipaddress.ip_address(row['start_ip'].strip())
+                end = ipaddress.ip_address(row['end_ip'].strip())
+                if start.version != end.version:
+                    raise ValueError('start_ip and end_ip are different address families')
+                if start > end:
+                    raise ValueError('start_ip is greater than end_ip')
+                yield {
+                    'start': ip_to_key(start),
+                    'end': ip_to_key(end),
+                    'latitude': _parse_coordinate(row.get('latitude'), 90, 'latitude'),
+                    'longitude': _parse_coordinate(row.get('longitude'), 180, 'longitude'),
+                    **{field: (row.get(field) or '').strip() or None for field in STRING_FIELDS},
+                }
+            except (ValueError, AttributeError) as e:
+                raise GeoIPDatabaseError(f'Line {line_number}: {e}')
+
+
+def compile_database(csv_path, output_path):
+    """
+    Compile a CSV range table into the binary format.
+    The file is written next to output_path and renamed into place, so
+    processes that already mapped the old file keep a consistent view
+    until get_database() notices the new file and maps it.
+    """
+    ranges = sorted(read_csv_ranges(csv_path), key=lambda r: r['start'])
+
+    for previous, current in zip(ranges, ranges[1:]):
+        if current['start'] <= previous['end']:
+            raise GeoIPDatabaseError(
+                f"Overlapping ranges starting at {ipaddress.IPv6Address(previous['start'])} "
+                f"and {ipaddress.IPv6Address(current['start'])}"
+            )
+
+    strings = bytearray()
+    string_offsets = {}
+
+    def intern(value):
+        if value is None:
+            return NO_STRING
+        if value not in string_offsets:
+            # Cut at the length limit without splitting a multibyte character
+            encoded = value.encode('utf-8')[:0xFFFF].decode('utf-8', 'ignore').encode('utf-8')
+            string_offsets[value] = len(strings)
+            strings.extend(STRING_LENGTH.pack(len(encoded)))
+            strings.extend(encoded)
+        return string_offsets[value]
+
+    records = bytearray()
+    for r in ranges:
+        records.extend(RECORD.pack(
+            r['latitude'], r['longitude'], *(intern(r[field]) for field in STRING_FIELDS)
+        ))
+
+    tmp_path = f'{output_path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(ranges)))
+        f.write(b''.join(r['start'] for r in ranges))
+        f.write(b''.join(r['end'] for r in ranges))
+        f.write(records)
+        f.write(strings)
+    os.replace(tmp_path, output_path)
+
+    return {
+        'ranges': len(ranges),
+        'strings': len(string_offsets),
+        'size_bytes': os.path.getsize(output_path),
+    }
+
+
+class GeoIPDatabase:
+    """Read-only, memory-mapped view of a compiled range database"""
+
+    def __init__(self, path):
+        self.path = str(path)
+        with open(self.path, 'rb') as f:
+            self.identity = file_identity(os.fstat(f.fileno()))
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self._mmap) < HEADER.size:
+            raise GeoIPDatabaseError(f'{self.path} is too small to be a geolocation database')
+        magic, version, count = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise GeoIPDatabaseError(f'{self.path} is not a geolocation database')
+        if version != FORMAT_VERSION:
+            raise GeoIPDatabaseError(f'{self.path} has unsupported format version {version}')
+
+        self.count = count
+        self._starts = HEADER.size
+        self._ends = self._starts + count * KEY_SIZE
+        self._records = self._ends + count * KEY_SIZE
+        self._strings = self._records + count * RECORD.size
+        if len(self._mmap) < self._strings:
+            raise GeoIPDatabaseError(f'{self.path} is truncated')
+
+    def close(self):
+        self._mmap.close()
+
+    def _start(self, index):
+        offset = self._starts + index * KEY_SIZE
+        return self._mmap[offset:offset + KEY_SIZE]
+
+    def _end(self, index):
+        offset = self._ends + index * KEY_SIZE
+        return self._mmap[offset:offset + KEY_SIZE]
+
+    def _string(self, offset):
+        if offset == NO_STRING:
+            return None
+        position = self._strings + offset
+        (length,) = STRING_LENGTH.unpack_from(self._mmap, position)
+        position += STRING_LENGTH.size
+        return self._mmap[position:position + length].decode('utf-8')
+
+    def find(self, ip_address):
+        """Index of the range containing the address, or None"""
+        key = ip_to_key(ip_address)
+
+        # Rightmost range whose start is <= key
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self._start(middle) <= key:
+                low = middle + 1
+            else:
+                high = middle
+
+        index = low - 1
+        if index < 0 or key > self._end(index):
+            return None
+        return index
+
+    def lookup(self, ip_address):
+        """Geolocation dict for the address, or None if no range covers it"""
+        index = self.find(ip_address)
+        if index is None:
+            return None
+
+        latitude, longitude, *string_offsets = RECORD.unpack_from(
+            self._mmap, self._records + index * RECORD.size
+        )
+        data = {
+            field: self._string(offset)
+            for field, offset in zip(STRING_FIELDS, string_offsets)
+        }
+        data['latitude'] = None if math.isnan(latitude) else latitude
+        data['longitude'] = None if math.isnan(longitude) else longitude
+        return data
+
+    def validate(self):
+        """Check ordering and bounds of every range; returns the range count"""
+        previous_end = None
+        for index in range(self.count):
+            start, end = self._start(index), self._end(index)
+            if start > end:
+                raise GeoIPDatabaseError(f'Range {index} ends before it starts')
+            if previous_end is not None and start <= previous_end:
+                raise GeoIPDatabaseError(f'Range {index} overlaps or is out of order')
+            previous_end = end
+
+            string_offsets = RECORD.unpack_from(self._mmap, self._records + index * RECORD.size)[2:]
+            for offset in string_offsets:
+                if offset != NO_STRING and self._strings + offset + STRING_LENGTH.size > len(self._mmap):
+                    raise GeoIPDatabaseError(f'Range {index} points outside the string table')
+        return self.count
+
+
+def file_identity(stat_result):
+    """What changes when a file is replaced or rewritten"""
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns)
+
+
+# path -> (GeoIPDatabase or None, time of the last check, identity of the file last tried)
+_databases = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path, check_interval=30):
+    """
+    Shared GeoIPDatabase for a path, opened once per process. At most every
+    check_interval seconds the path is stat()ed, and a recompiled file is
+    mapped in place of the old one; lookups already running finish on the
+    old mapping. Returns None if the file does not exist, or if it cannot
+    be opened and no earlier file was; a file that failed to open is not
+    tried again until a check finds it changed.
+    """
+    path = str(path)
+    now = time.monotonic()
+    entry = _databases.get(path)
+    if entry is not None and now - entry[1] < check_interval:
+        return entry[0]
+
+    with _databases_lock:
+        entry = _databases.get(path)
+        if entry is not None and now - entry[1] < check_interval:
+            return entry[0]
+        database, _, tried_identity = entry if entry else (None, None, None)
+
+        try:
+            identity = file_identity(os.stat(path))
+        except FileNotFoundError:
+            _databases.pop(path, None)
+            return None
+
+        if identity != tried_identity:
+            try:
+                database = GeoIPDatabase(path)
+            except (OSError, GeoIPDatabaseError) as e:
+                # Keep serving the old file, if any, rather than none at all
+                print(f"Error opening geolocation database {path}: {e}")
+        # The old mapping is closed once no lookup references it
+        _databases[path] = (database, now, identity)
+        return database
@@ -1,52 +1,353 @@
-import requests
-from django.core.cache import cache
+import ipaddress
+import os
+import threading
 import time
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .circuit_breaker import CircuitBreaker
+from .geoip_db import get_database
+from .local_cache import LocalLRUCache, TieredCache
+from .metrics import metrics
+from .singleflight import SingleFlight
+
+_settings = getattr(settings, 'IPGEOLOCATION_SETTINGS', {})
+
+# Shared by every GeolocationService in the process so concurrent misses
+# for the same IP result in a single provider lookup
+geolocation_flight = SingleFlight(
+    'ip_geolocation',
+    lock_timeout=_settings.get('LOOKUP_LOCK_TIMEOUT', 15),
+    wait_timeout=_settings.get('LOOKUP_WAIT_TIMEOUT', 12),
+)
+
+
+def _local_ttl(data):
+    # Failed lookups must not outlive their short shared-cache TTL in process memory
+    if data.get('error'):
+        return _settings.get('NEGATIVE_CACHE_TTL', 300)
+    return None
+
+
+# Hot IPs are served from process memory; only first-seen IPs reach the shared cache
+geolocation_cache = TieredCache(
+    LocalLRUCache(
+        max_entries=_settings.get('LOCAL_CACHE_SIZE', 10000),
+        default_ttl=_settings.get('LOCAL_CACHE_TTL', 3600),
+        jitter=_settings.get('LOCAL_CACHE_JITTER', 0.1),
+    ),
+    local_ttl=_local_ttl,
+)
+
+LOOKUPS_TOTAL = 'ip_tracking_geolocation_lookups_total'
+PROVIDER_SECONDS = 'ip_tracking_geolocation_provider_seconds'
+PROVIDER_FAILURES_TOTAL = 'ip_tracking_geolocation_provider_failures_total'
+
+# Per-provider circuit breakers, shared by every GeolocationService in the process
+provider_breakers = {}
+
+
+def get_provider_breaker(name):
+    breaker = provider_breakers.get(name)
+    if breaker is None:
+        breaker = provider_breakers.setdefault(name, CircuitBreaker(
+            name,
+            failure_threshold=_settings.get('CIRCUIT_BREAKER_FAILURES', 5),
+            cooldown=_settings.get('CIRCUIT_BREAKER_COOLDOWN', 60),
+        ))
+    return breaker
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(name):
+    """Keep-alive HTTP session for a provider, one pool per provider per process"""
+    key = (name, os.getpid())
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1,
+                    pool_maxsize=_settings.get('HTTP_POOL_SIZE', 10)
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                _sessions[key] = session
+    return session
+
+
+def empty_geolocation(error):
+    """Geolocation payload with no location, as returned when a lookup cannot succeed"""
+    return {
+        'country': None,
+        'city': None,
+        'region': None,
+        'latitude': None,
+        'longitude': None,
+        'error': error
+    }
 
 class GeolocationService:
     """Enhanced geolocation service with multiple fallbacks"""
     
     def __init__(self):
         self.services = [
+            self._local_database_service,
             self._ipapi_service,
             self._ipapi_co_service,
         ]
+        # The local database has no outage to protect against
+        self.breakers = {
+            '_ipapi_service': get_provider_breaker('ipapi.co'),
+            '_ipapi_co_service': get_provider_breaker('ip-api.com'),
+        }
+        # Names used in metrics
+        self.provider_names = {
+            '_local_database_service': 'local_database',
+            '_ipapi_service': 'ipapi.co',
+            '_ipapi_co_service': 'ip-api.com',
+        }
+        # Providers that can resolve many IPs in one call
+        self.batch_services = {
+            '_ipapi_co_service': self._ipapi_co_batch_service,
+        }
+        self.batch_size = _settings.get('BATCH_SIZE', 100)
+        self.timeout = _settings.get('BACKEND_TIMEOUT', 5)
+    
+    def cache_key(self, ip_address):
+        return f"ip_geolocation_{ip_address}"
+    
+    def get_cached_geolocation(self, ip_address):
+        """Return cached geolocation data without any network lookup, or None"""
+        local_answer = self._local_answer(ip_address)
+        if local_answer:
+            metrics.inc(LOOKUPS_TOTAL, source='local')
+            return local_answer
+        data = geolocation_cache.get(self.cache_key(ip_address))
+        metrics.inc(LOOKUPS_TOTAL, source='cache_hit' if data else 'cache_miss')
+        return data
+    
+    async def aget_cached_geolocation(self, ip_address):
+        """Async get_cached_geolocation; only a local-tier miss awaits the shared cache"""
+        local_answer = self._local_answer(ip_address)
+        if local_answer:
+            metrics.inc(LOOKUPS_TOTAL, source='local')
+            return local_answer
+        data = await geolocation_cache.aget(self.cache_key(ip_address))
+        metrics.inc(LOOKUPS_TOTAL, source='cache_hit' if data else 'cache_miss')
+        return data
+    
+    def provider_name(self, service):
+        return self.provider_names.get(service.__name__, service.__name__)
     
     def get_geolocation(self, ip_address):
         """Try multiple geolocation services until one works"""
-        cache_key = f"ip_geolocation_{ip_address}"
+        cache_key = self.cache_key(ip_address)
         
-        # Try cache first
-        cached_data = cache.get(cache_key)
+        # Private, reserved and malformed addresses never leave the process
+        local_answer = self._local_answer(ip_address)
+        if local_answer:
+            metrics.inc(LOOKUPS_TOTAL, source='local')
+            return local_answer
+        
+        # Try cache first; this includes recently failed lookups
+        cached_data = geolocation_cache.get(cache_key)
         if cached_data:
+            metrics.inc(LOOKUPS_TOTAL, source='cache_hit')
             return cached_data
         
+        metrics.inc(LOOKUPS_TOTAL, source='cache_miss')
+        # Concurrent misses for the same IP wait for one lookup. Waiting on
+        # another process polls the raw key, so this miss is counted once.
+        return geolocation_flight.do(
+            ip_address,
+            lambda: self._lookup(ip_address),
+            read_shared=lambda: geolocation_cache.get(cache_key)
+        )
+    
+    def get_geolocation_many(self, ip_addresses):
+        """
+        Resolve many IPs at once; returns {ip_address: geolocation data}.
+        The cache is read with one get_many. Misses that another thread or
+        process is already looking up are waited for; the rest go to
+        _lookup_many().
+        """
+        results = {}
+        pending = []
+        for ip_address in dict.fromkeys(ip_addresses):
+            local_answer = self._local_answer(ip_address)
+            if local_answer:
+                results[ip_address] = local_answer
+            else:
+                pending.append(ip_address)
+        
+        cached = geolocation_cache.get_many([self.cache_key(ip) for ip in pending])
+        misses = []
+        for ip_address in pending:
+            data = cached.get(self.cache_key(ip_address))
+            if data:
+                results[ip_address] = data
+            else:
+                misses.append(ip_address)
+        
+        if misses:
+            results.update(geolocation_flight.do_many(misses, self._lookup_many, read_shared=self._read_cached_many))
+        return results
+    
+    def _read_cached_many(self, ip_addresses):
+        """Cached answers for ip_addresses, without recording lookup metrics"""
+        cached = geolocation_cache.get_many([self.cache_key(ip) for ip in ip_addresses])
+        return {ip: cached[self.cache_key(ip)] for ip in ip_addresses if self.cache_key(ip) in cached}
+    
+    def _lookup_many(self, misses):
+        """
+        Look up IPs nobody has cached: the local database first, then remote
+        providers in batches, batch-capable ones first, so each remote
+        endpoint only sees what everything before it could not resolve.
+        Every answer is cached, failures briefly.
+        """
+        results = {}
+        # Providers without a breaker are local and cost nothing; sorted() keeps the order otherwise
+        services = sorted(self.services, key=lambda service: (
+            service.__name__ in self.breakers,
+            service.__name__ not in self.batch_services,
+        ))
+        for service in services:
+            if not misses:
+                break
+            
+            found = {}
+            provider = self.provider_name(service)
+            breaker = self.breakers.get(service.__name__)
+            batch_service = self.batch_services.get(service.__name__)
+            step = self.batch_size if batch_service else 1
+            for start in range(0, len(misses), step):
+                chunk = misses[start:start + step]
+                if breaker and not breaker.allow():
+                    break
+                
+                try:
+                    with metrics.timer(PROVIDER_SECONDS, provider=provider):
+                        if batch_service:
+                            answers = batch_service(chunk)
+                        else:
+                            answers = {chunk[0]: service(chunk[0])}
+                except Exception as e:
+                    print(f"Geolocation service failed: {e}")
+                    answers = None
+                
+                # A batch call that answered at all is a provider success
+                if batch_service:
+                    succeeded = answers is not None
+                else:
+                    succeeded = bool(answers and answers[chunk[0]])
+                if not succeeded:
+                    metrics.inc(PROVIDER_FAILURES_TOTAL, provider=provider)
+                if breaker:
+                    if succeeded:
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+                
+                for ip_address, data in (answers or {}).items():
+                    if data and data.get('country'):
+                        found[ip_address] = data
+            
+            if found:
+                # Cache successful results for 24 hours
+                geolocation_cache.set_many({self.cache_key(ip): data for ip, data in found.items()}, 86400)
+                results.update(found)
+                misses = [ip for ip in misses if ip not in found]
+        
+        if misses:
+            failures = {ip: empty_geolocation('All geolocation services failed') for ip in misses}
+            geolocation_cache.set_many(
+                {self.cache_key(ip): data for ip, data in failures.items()},
+                _settings.get('NEGATIVE_CACHE_TTL', 300)
+            )
+            results.update(failures)
+        
+        return results
+    
+    def get_stats(self):
+        """Lookup coalescing, cache tier and provider circuit counters for this process"""
+        stats = geolocation_flight.stats()
+        stats['cache'] = geolocation_cache.stats()
+        stats['providers'] = {name: breaker.stats() for name, breaker in provider_breakers.items()}
+        return stats
+    
+    def _local_answer(self, ip_address):
+        """Answer for addresses no provider can locate, or None"""
+        try:
+            address = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return empty_geolocation('Invalid IP address')
+        
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+        if not address.is_global or address.is_multicast:
+            return empty_geolocation('Private or reserved IP address')
+        return None
+    
+    def _lookup(self, ip_address):
+        """Query the services in order and cache the first usable answer"""
+        cache_key = self.cache_key(ip_address)
+        
         # Try each service until one succeeds
         for service in self.services:
+            breaker = self.breakers.get(service.__name__)
+            if breaker and not breaker.allow():
+                continue
+            
+            provider = self.provider_name(service)
+            data = None
             try:
-                data = service(ip_address)
-                if data and data.get('country'):
-                    # Cache successful result for 24 hours
-                    cache.set(cache_key, data, 86400)
-                    return data
-                time.sleep(0.1)  # Small delay between services
+                with metrics.timer(PROVIDER_SECONDS, provider=provider):
+                    data = service(ip_address)
             except Exception as e:
                 print(f"Geolocation service failed: {e}")
-                continue
+            
+            if data and data.get('country'):
+                if breaker:
+                    breaker.record_success()
+                # Cache successful result for 24 hours
+                geolocation_cache.set(cache_key, data, 86400)
+                return data
+            metrics.inc(PROVIDER_FAILURES_TOTAL, provider=provider)
+            if breaker:
+                breaker.record_failure()
         
-        # Return empty data if all services fail
-        return {
-            'country': None,
-            'city': None,
-            'region': None,
-            'latitude': None,
-            'longitude': None,
-            'error': 'All geolocation services failed'
-        }
+        # Cache the failure briefly so the IP is not looked up on every request
+        data = empty_geolocation('All geolocation services failed')
+        geolocation_cache.set(cache_key, data, _settings.get('NEGATIVE_CACHE_TTL', 300))
+        return data
+    
+    def _local_database_service(self, ip_address):
+        """Offline lookup in the compiled, memory-mapped IP range database"""
+        config = getattr(settings, 'IPGEOLOCATION_SETTINGS', {})
+        path = config.get('LOCAL_DATABASE')
+        if not path:
+            return None
+        
+        database = get_database(path, config.get('LOCAL_DATABASE_CHECK_INTERVAL', 30))
+        if database is None:
+            return None
+        
+        data = database.lookup(ip_address)
+        if data:
+            data['service'] = 'local'
+        return data
     
     def _ipapi_service(self, ip_address):
         """Use ipapi.co service (free tier available)"""
         try:
-            response = requests.get(f'http://ipapi.co/{ip_address}/json/', timeout=5)
+            response = get_session('ipapi.co').get(f'http://ipapi.co/{ip_address}/json/', timeout=self.timeout)
             if response.status_code == 200:
                 data = response.json()
                 return {
@@ -67,21 +368,65 @@ class GeolocationService:
     def _ipapi_co_service(self, ip_address):
         """Alternative: ip-api.com service (free for non-commercial use)"""
         try:
-            response = requests.get(f'http://ip-api.com/json/{ip_address}', timeout=5)
+            response = get_session('ip-api.com').get(f'http://ip-api.com/json/{ip_address}', timeout=self.timeout)
             if response.status_code == 200:
-                data = response.json()
-                if data.get('status') == 'success':
-                    return {
-                        'country': data.get('country'),
-                        'country_code': data.get('countryCode'),
-                        'city': data.get('city'),
-                        'region': data.get('regionName'),
-                        'latitude': data.get('lat'),
-                        'longitude': data.get('lon'),
-                        'timezone': data.get('timezone'),
-                        'isp': data.get('isp'),
-                        'service': 'ip-api.com'
-                    }
+                return self._parse_ip_api(response.json())
         except Exception as e:
             print(f"ip-api.com service error: {e}")
-        return None
\ No newline at end of file
+        return None
+    
+    def _ipapi_co_batch_service(self, ip_addresses):
+        """ip-api.com batch endpoint: up to 100 IPs per POST, answers in request order"""
+        try:
+            response = get_session('ip-api.com').post(
+                'http://ip-api.com/batch',
+                json=list(ip_addresses),
+                timeout=self.timeout
+            )
+            # The free tier reports its remaining batch quota; wait out the window when it runs out
+            if response.headers.get('X-Rl') == '0':
+                time.sleep(min(int(response.headers.get('X-Ttl', 0)), 60))
+            if response.status_code == 200:
+                return {
+                    ip_address: self._parse_ip_api(data)
+                    for ip_address, data in zip(ip_addresses, response.json())
+                }
+        except Exception as e:
+            print(f"ip-api.com batch service error: {e}")
+        return None
+    
+    def _parse_ip_api(self, data):
+        if data.get('status') != 'success':
+            return None
+        return {
+            'country': data.get('country'),
+            'country_code': data.get('countryCode'),
+            'city': data.get('city'),
+            'region': data.get('regionName'),
+            'latitude': data.get('lat'),
+            'longitude': data.get('lon'),
+            'timezone': data.get('timezone'),
+            'isp': data.get('isp'),
+            'service': 'ip-api.com'
+        }
+
+
+def _collect_metrics():
+    stats = geolocation_cache.stats()
+    yield 'ip_tracking_geolocation_cache_entries', {}, stats['size']
+    for tier, result in (('local', 'hits'), ('local', 'misses'), ('shared', 'hits'), ('shared', 'misses')):
+        key = result if tier == 'local' else f'shared_{result}'
+        yield 'ip_tracking_geolocation_cache_requests_total', {'tier': tier, 'result': result}, stats[key]
+    yield 'ip_tracking_geolocation_cache_evictions_total', {}, stats['evictions']
+    for outcome, count in geolocation_flight.stats().items():
+        yield 'ip_tracking_geolocation_coalescing_total', {'outcome': outcome}, count
+    for name, breaker in provider_breakers.items():
+        yield 'ip_tracking_geolocation_circuit_open', {'provider': name}, int(breaker.state != CircuitBreaker.CLOSED)
+
+
+metrics.gauge('ip_tracking_geolocation_cache_entries', 'Geolocation results held in process memory')
+metrics.counter('ip_tracking_geolocation_cache_requests_total', 'Geolocation cache reads by tier and result')
+metrics.counter('ip_tracking_geolocation_cache_evictions_total', 'Geolocation results evicted from process memory')
+metrics.counter('ip_tracking_geolocation_coalescing_total', 'Geolocation misses by single-flight outcome: executed, coalesced_local, coalesced_remote or wait_timeouts')
+metrics.gauge('ip_tracking_geolocation_circuit_open', 'Whether a provider circuit breaker is not closed')
+metrics.register_collector(_collect_metrics)
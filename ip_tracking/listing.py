@@ -0,0 +1,55 @@
+"""
+Row output for the list_blocked_ips and list_suspicious_ips commands.
+
+Rows are written as they are read from the database, so memory use does not
+depend on the table size. CSV and NDJSON output carry no banner lines and can
+be piped straight into other tools.
+"""
+import csv
+import datetime
+import ipaddress
+import json
+
+OUTPUT_FORMATS = ('text', 'csv', 'ndjson')
+
+
+def parse_cidr_filter(value):
+    """ip_network for a --cidr option; host bits are allowed here"""
+    return ipaddress.ip_network(str(value).strip(), strict=False)
+
+
+def overlaps(candidate, network):
+    """True if the ip_network candidate shares any address with network"""
+    return candidate.version == network.version and candidate.overlaps(network)
+
+
+def plain_row(row):
+    """Row with datetimes as ISO 8601 strings"""
+    return {
+        field: value.isoformat() if isinstance(value, datetime.datetime) else value
+        for field, value in row.items()
+    }
+
+
+class RowWriter:
+    """Writes dict rows to stream as CSV, NDJSON, or lines from format_text(row)"""
+
+    def __init__(self, stream, output_format, fields, format_text=None):
+        self.stream = stream
+        self.output_format = output_format
+        self.fields = fields
+        self.format_text = format_text
+        self.count = 0
+        self._csv = None
+
+    def write(self, row):
+        if self.output_format == 'ndjson':
+            self.stream.write(json.dumps(plain_row(row)) + '\n')
+        elif self.output_format == 'csv':
+            if self._csv is None:
+                self._csv = csv.DictWriter(self.stream, fieldnames=self.fields, lineterminator='\n')
+                self._csv.writeheader()
+            self._csv.writerow(plain_row(row))
+        else:
+            self.stream.write(self.format_text(row) + '\n')
+        self.count += 1
@@ -0,0 +1,152 @@
+import collections
+import random
+import threading
+import time
+
+from django.core.cache import cache
+
+
+class LocalLRUCache:
+    """
+    Size-bounded, thread-safe in-process cache with per-entry TTL.
+    Expiry times get random jitter so entries filled together (a burst of
+    new IPs, a warm-up) do not all fall through to the shared cache together.
+    """
+
+    def __init__(self, max_entries=10000, default_ttl=3600, jitter=0.1):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.jitter = jitter
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store a value; ttl is capped at the cache's default_ttl"""
+        ttl = self.default_ttl if ttl is None else min(ttl, self.default_ttl)
+        ttl *= 1 - random.uniform(0, self.jitter)
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._data),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+class TieredCache:
+    """
+    A LocalLRUCache in front of the shared Django cache.
+    Reads check process memory first and promote shared-cache hits into it;
+    writes go to both tiers. ``local_ttl(value)`` picks how long a promoted
+    value may live locally, since the shared cache does not report it.
+    """
+
+    def __init__(self, local, shared=None, local_ttl=None):
+        self.local = local
+        self.shared = cache if shared is None else shared
+        self.local_ttl = local_ttl or (lambda value: None)
+        self.shared_hits = 0
+        self.shared_misses = 0
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        value = self.shared.get(key)
+        if value is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, value, self.local_ttl(value))
+        return value
+
+    async def aget(self, key):
+        """get() for async callers; only a local miss awaits the shared cache"""
+        value = self.local.get(key)
+        if value is not None:
+            return value
+
+        value = await self.shared.aget(key)
+        if value is None:
+            self.shared_misses += 1
+            return None
+        self.shared_hits += 1
+        self.local.set(key, value, self.local_ttl(value))
+        return value
+
+    def get_many(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self.local.get(key)
+            if value is not None:
+                found[key] = value
+            else:
+                missing.append(key)
+
+        if missing:
+            shared_found = self.shared.get_many(missing)
+            self.shared_hits += len(shared_found)
+            self.shared_misses += len(missing) - len(shared_found)
+            for key, value in shared_found.items():
+                self.local.set(key, value, self.local_ttl(value))
+            found.update(shared_found)
+        return found
+
+    def set(self, key, value, timeout):
+        self.shared.set(key, value, timeout)
+        self.local.set(key, value, timeout)
+
+    def set_many(self, data, timeout):
+        self.shared.set_many(data, timeout)
+        for key, value in data.items():
+            self.local.set(key, value, timeout)
+
+    def delete(self, key):
+        self.shared.delete(key)
+        self.local.delete(key)
+
+    def stats(self):
+        stats = self.local.stats()
+        stats['shared_hits'] = self.shared_hits
+        stats['shared_misses'] = self.shared_misses
+        return stats
@@ -0,0 +1,145 @@
+"""
+Access-log parsing for the import_request_logs command.
+
+Nothing here touches Django, so parse_chunk() can run in worker processes.
+"""
+import collections
+import contextlib
+import gzip
+import ipaddress
+import json
+import re
+import sys
+from datetime import datetime, timezone as dt_timezone
+from urllib.parse import urlsplit
+
+FORMATS = ('auto', 'jsonl', 'combined')
+
+# host ident user [time] "METHOD target PROTOCOL" status size ...
+COMBINED_LOG_RE = re.compile(r'^(\S+) \S+ \S+ \[([^\]]+)\] "\S+ (\S+)[^"]*"')
+COMBINED_TIME_FORMAT = '%d/%b/%Y:%H:%M:%S %z'
+
+PATH_MAX_LENGTH = 255
+GEO_FIELDS = ('country', 'city', 'region')
+
+ParsedLine = collections.namedtuple('ParsedLine', ['ip_address', 'path', 'timestamp', 'geolocation'])
+
+
+def open_log(path):
+    """
+    Open a log file for line-by-line reading, as a context manager; '-' is
+    stdin, which is left open on exit, and .gz files are decompressed.
+    """
+    if path == '-':
+        return contextlib.nullcontext(sys.stdin)
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, encoding='utf-8', errors='replace')
+
+
+def clean_ip(value):
+    """Normalised address string; ValueError if it is not an IP address"""
+    address = ipaddress.ip_address(str(value).strip())
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return str(address)
+
+
+def clean_path(value):
+    """Request path without query string or host, as the middleware logs it"""
+    path = urlsplit(str(value)).path or '/'
+    return path[:PATH_MAX_LENGTH]
+
+
+def parse_timestamp(value):
+    """datetime from ISO 8601 or epoch seconds; naive if the input had no offset"""
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+    return datetime.fromisoformat(str(value).strip().replace('Z', '+00:00'))
+
+
+def parse_json_line(line):
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('not a JSON object')
+    # view_logs exports use 'ip'; model dumps use 'ip_address'
+    ip_address = record.get('ip', record.get('ip_address'))
+    if ip_address is None or 'path' not in record or 'timestamp' not in record:
+        raise ValueError('missing ip, path or timestamp')
+
+    geolocation = {field: record[field] for field in GEO_FIELDS if record.get(field)}
+    return ParsedLine(
+        clean_ip(ip_address),
+        clean_path(record['path']),
+        parse_timestamp(record['timestamp']),
+        geolocation or None,
+    )
+
+
+def parse_combined_line(line):
+    match = COMBINED_LOG_RE.match(line)
+    if match is None:
+        raise ValueError('not in combined log format')
+    ip_address, timestamp, target = match.groups()
+    return ParsedLine(
+        clean_ip(ip_address),
+        clean_path(target),
+        datetime.strptime(timestamp, COMBINED_TIME_FORMAT),
+        None,
+    )
+
+
+def parse_line(line, log_format='auto'):
+    """ParsedLine for one log line; ValueError if it cannot be used"""
+    if log_format == 'jsonl' or (log_format == 'auto' and line.startswith('{')):
+        return parse_json_line(line)
+    return parse_combined_line(line)
+
+
+def parse_chunk(lines, log_format='auto'):
+    """Parse a list of lines; returns (parsed lines, number of invalid lines)"""
+    parsed = []
+    invalid = 0
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            parsed.append(parse_line(line, log_format))
+        except (ValueError, TypeError):
+            invalid += 1
+    return parsed, invalid
+
+
+def read_chunks(stream, chunk_lines):
+    """Lists of up to chunk_lines lines, without reading the whole stream"""
+    chunk = []
+    for line in stream:
+        chunk.append(line)
+        if len(chunk) >= chunk_lines:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def parse_stream(stream, log_format='auto', chunk_lines=10000, pool=None, max_pending=4):
+    """
+    Yield (parsed lines, invalid count, raw line count) per chunk, in file order.
+    With a multiprocessing pool, up to max_pending chunks are parsed at once;
+    reading stops there, so memory stays bounded however large the file is.
+    """
+    if pool is None:
+        for chunk in read_chunks(stream, chunk_lines):
+            yield parse_chunk(chunk, log_format) + (len(chunk),)
+        return
+
+    pending = collections.deque()
+    for chunk in read_chunks(stream, chunk_lines):
+        pending.append((pool.apply_async(parse_chunk, (chunk, log_format)), len(chunk)))
+        if len(pending) >= max_pending:
+            result, line_count = pending.popleft()
+            yield result.get() + (line_count,)
+    while pending:
+        result, line_count = pending.popleft()
+        yield result.get() + (line_count,)
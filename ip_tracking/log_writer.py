@@ -0,0 +1,174 @@
+import atexit
+import collections
+import os
+import threading
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connection
+
+from .metrics import metrics
+
+
+def get_log_writer_settings():
+    """Request log writer settings with defaults applied"""
+    config = {
+        'ENABLED': True,        # False writes each row synchronously
+        'BATCH_SIZE': 500,      # Rows per bulk_create, and the early-flush threshold
+        'FLUSH_INTERVAL': 2.0,  # Seconds between background flushes
+        'MAX_BUFFER': 10000,    # Rows held in memory before new rows are dropped
+    }
+    config.update(getattr(settings, 'REQUEST_LOG_WRITER', {}))
+    return config
+
+
+class RequestLogWriter:
+    """
+    Buffers RequestLog rows in memory and writes them with bulk_create
+    from a background thread.
+
+    A flush happens every FLUSH_INTERVAL seconds, or as soon as BATCH_SIZE
+    rows are waiting, and once more when the process exits.
+
+    Backpressure policy: memory is bounded by MAX_BUFFER rows. When the
+    buffer is full the incoming row is dropped (never the request) and
+    counted in ``dropped``. A batch that fails to write is dropped as well
+    and counted in ``failed``, so a database outage cannot grow the buffer.
+    """
+
+    def __init__(self, enabled=None, batch_size=None, flush_interval=None, max_buffer=None):
+        config = get_log_writer_settings()
+        self.enabled = config['ENABLED'] if enabled is None else enabled
+        self.batch_size = batch_size or config['BATCH_SIZE']
+        self.flush_interval = flush_interval or config['FLUSH_INTERVAL']
+        self.max_buffer = max_buffer or config['MAX_BUFFER']
+
+        self._buffer = collections.deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def write(self, entry):
+        """Queue an unsaved RequestLog; returns False if it was dropped"""
+        if not self.enabled:
+            entry.save()
+            self.written += 1
+            self._count([entry])
+            return True
+
+        self._ensure_started()
+        with self._lock:
+            if len(self._buffer) >= self.max_buffer:
+                self.dropped += 1
+                return False
+            self._buffer.append(entry)
+            batch_ready = len(self._buffer) >= self.batch_size
+
+        if batch_ready:
+            self._wakeup.set()
+        return True
+
+    async def awrite(self, entry):
+        """write() for async callers; only the unbuffered path touches the database"""
+        if not self.enabled:
+            await entry.asave()
+            self.written += 1
+            await sync_to_async(self._count)([entry])
+            return True
+        return self.write(entry)
+
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows written"""
+        from .models import RequestLog
+
+        total = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    count = min(self.batch_size, len(self._buffer))
+                    batch = [self._buffer.popleft() for _ in range(count)]
+                if not batch:
+                    return total
+
+                try:
+                    RequestLog.objects.bulk_create(batch, batch_size=self.batch_size)
+                except Exception as e:
+                    self.failed += len(batch)
+                    print(f"Error writing {len(batch)} request logs: {e}")
+                    continue
+
+                total += len(batch)
+                self.written += len(batch)
+                self._count(batch)
+
+    def _count(self, entries):
+        """Add written rows to the running request counters"""
+        from .request_counters import counter_deltas, increment_counters
+
+        try:
+            increment_counters(counter_deltas(entries))
+        except Exception as e:
+            print(f"Error updating request counters: {e}")
+
+    def close(self, timeout=10):
+        """Stop the background thread and write whatever is left"""
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self.flush()
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so a pre-forked worker starts its own
+        if self._pid == os.getpid() and self._thread is not None:
+            return
+
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None:
+                return
+            if self._pid != os.getpid():
+                # Rows copied from the parent belong to the parent
+                self._buffer.clear()
+                self._stop.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run,
+                name='request-log-writer',
+                daemon=True,
+            )
+            self._thread.start()
+
+    def _run(self):
+        try:
+            while not self._stop.is_set():
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()
+                self.flush()
+        finally:
+            connection.close()
+
+
+# Shared by every IPLoggingMiddleware instance in this process
+request_log_writer = RequestLogWriter()
+atexit.register(request_log_writer.close)
+
+
+def _collect_metrics():
+    for outcome in ('written', 'dropped', 'failed'):
+        yield 'ip_tracking_request_log_rows_total', {'outcome': outcome}, getattr(request_log_writer, outcome)
+    yield 'ip_tracking_request_log_pending_rows', {}, request_log_writer.pending()
+
+
+metrics.counter('ip_tracking_request_log_rows_total', 'Request log rows by outcome: written, dropped (buffer full) or failed')
+metrics.gauge('ip_tracking_request_log_pending_rows', 'Request log rows buffered and not yet written')
+metrics.register_collector(_collect_metrics)
@@ -1,16 +1,23 @@
 from django.core.management.base import BaseCommand, CommandError
-from ip_tracking.models import BlockedIP
-import ipaddress
+from ip_tracking.blocklist_import import Throughput, block_many, clean_batches, read_values, sync_blocklist
 
 class Command(BaseCommand):
-    help = 'Add IP addresses to the blocklist'
+    help = 'Add IP addresses and CIDR networks to the blocklist'
     
     def add_arguments(self, parser):
         parser.add_argument(
             'ip_addresses',
-            nargs='+',
+            nargs='*',
             type=str,
-            help='IP addresses to block (space separated)'
+            help='IP addresses or CIDR networks to block (space separated)'
+        )
+        
+        parser.add_argument(
+            '--file',
+            dest='files',
+            action='append',
+            default=[],
+            help="Read one address or CIDR per line from this file ('-' reads stdin); may be repeated"
         )
         
         parser.add_argument(
@@ -18,51 +25,63 @@ class Command(BaseCommand):
             type=str,
             help='Reason for blocking the IP address(es)'
         )
+        
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Entries validated and written per transaction (default: 5000)'
+        )
+        
+        parser.add_argument(
+            '--sync',
+            action='store_true',
+            help='Replace the whole blocklist with the given entries, writing only the difference'
+        )
+        
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='With --sync, report the difference without writing it'
+        )
     
     def handle(self, *args, **options):
-        ip_addresses = options['ip_addresses']
-        reason = options.get('reason', 'No reason provided')
-        
-        blocked_count = 0
-        skipped_count = 0
+        if not options['ip_addresses'] and not options['files']:
+            raise CommandError('Give IP addresses, networks or --file')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['dry_run'] and not options['sync']:
+            raise CommandError('--dry-run only applies to --sync')
         
-        for ip_str in ip_addresses:
-            try:
-                # Validate IP address
-                ipaddress.ip_address(ip_str)
-                
-                # Create or get the blocked IP entry
-                blocked_ip, created = BlockedIP.objects.get_or_create(
-                    ip_address=ip_str,
-                    defaults={'reason': reason}
-                )
-                
-                if created:
-                    self.stdout.write(
-                        self.style.SUCCESS(f'Successfully blocked IP: {ip_str}')
-                    )
-                    blocked_count += 1
-                else:
-                    self.stdout.write(
-                        self.style.WARNING(f'IP already blocked: {ip_str}')
-                    )
-                    skipped_count += 1
-                    
-            except ValueError:
-                self.stdout.write(
-                    self.style.ERROR(f'Invalid IP address: {ip_str}')
-                )
-                skipped_count += 1
-            except Exception as e:
-                self.stdout.write(
-                    self.style.ERROR(f'Error blocking IP {ip_str}: {e}')
-                )
-                skipped_count += 1
+        self.invalid_count = 0
+        throughput = Throughput()
+        try:
+            batches = clean_batches(
+                read_values(options['ip_addresses'], options['files']),
+                options['batch_size'],
+                on_invalid=self.report_invalid
+            )
+            if options['sync']:
+                stats = sync_blocklist(batches, options['reason'], options['batch_size'], options['dry_run'])
+            else:
+                stats = block_many(batches, options['reason'], options['batch_size'])
+        except OSError as e:
+            raise CommandError(f'Cannot read blocklist file: {e}')
         
-        self.stdout.write(
-            self.style.SUCCESS(
-                f'Blocking complete. {blocked_count} new IPs blocked, '
-                f'{skipped_count} IPs skipped.'
+        if options['sync']:
+            prefix = 'Dry run, would sync' if options['dry_run'] else 'Sync complete'
+            summary = (
+                f"{prefix}. {stats['created']} added, {stats['deleted']} removed, "
+                f"{stats['unchanged']} unchanged"
             )
-        )
-        
\ No newline at end of file
+        else:
+            summary = (
+                f"Blocking complete. {stats['created']} new entries blocked, "
+                f"{stats['existing']} already blocked"
+            )
+        self.stdout.write(self.style.SUCCESS(f"{summary}, {self.invalid_count} invalid."))
+        self.stdout.write(f"Processed {throughput.report(stats['seen'] + self.invalid_count)}")
+    
+    def report_invalid(self, value, error):
+        self.invalid_count += 1
+        self.stderr.write(self.style.ERROR(f'Invalid IP address or network: {value}'))
@@ -0,0 +1,64 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.geoip_db import CSV_COLUMNS, GeoIPDatabase, GeoIPDatabaseError, compile_database
+import os
+import time
+
+class Command(BaseCommand):
+    help = 'Compile a CSV IP range table into the memory-mapped geolocation database'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'csv_path',
+            nargs='?',
+            type=str,
+            help=f"CSV file with a header row. Columns: {', '.join(CSV_COLUMNS)}"
+        )
+        
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Where to write the database (default: IPGEOLOCATION_SETTINGS LOCAL_DATABASE)'
+        )
+        
+        parser.add_argument(
+            '--validate-only',
+            action='store_true',
+            help='Only validate an existing compiled database'
+        )
+    
+    def handle(self, *args, **options):
+        output_path = options['output'] or settings.IPGEOLOCATION_SETTINGS.get('LOCAL_DATABASE')
+        if not output_path:
+            raise CommandError('No --output given and LOCAL_DATABASE is not configured')
+        output_path = str(output_path)
+        
+        if not options['validate_only']:
+            if not options['csv_path']:
+                raise CommandError('A CSV file is required unless --validate-only is given')
+            
+            os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+            started = time.monotonic()
+            try:
+                stats = compile_database(options['csv_path'], output_path)
+            except (GeoIPDatabaseError, OSError) as e:
+                raise CommandError(f'Compilation failed: {e}')
+            
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Compiled {stats['ranges']} ranges ({stats['strings']} distinct strings, "
+                    f"{stats['size_bytes']} bytes) into {output_path} "
+                    f"in {time.monotonic() - started:.2f}s"
+                )
+            )
+        
+        try:
+            database = GeoIPDatabase(output_path)
+            try:
+                range_count = database.validate()
+            finally:
+                database.close()
+        except (GeoIPDatabaseError, OSError) as e:
+            raise CommandError(f'Validation failed: {e}')
+        
+        self.stdout.write(self.style.SUCCESS(f'Validated {range_count} ranges in {output_path}'))
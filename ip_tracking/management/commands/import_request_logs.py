@@ -0,0 +1,236 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from ip_tracking.geolocation import GeolocationService
+from ip_tracking.log_import import FORMATS, open_log, parse_stream
+from ip_tracking.models import RequestLog, RequestLogHourlyCountry, RequestLogHourlyIP
+from ip_tracking.path_classifier import sensitive_path_matcher
+from ip_tracking.request_counters import counter_deltas, increment_counters
+from ip_tracking.rollups import add_to_rollups, floor_hour, rolled_up_until
+from datetime import timezone as dt_timezone
+import multiprocessing
+import time
+
+# Rows compared against stored ones when checking whether a file was imported before
+DUPLICATE_CHECK_ROWS = 500
+
+
+class Command(BaseCommand):
+    help = (
+        'Import historical traffic into RequestLog from JSONL or combined-format access logs. '
+        'Rows are appended, so importing a file twice counts its traffic twice; a file whose '
+        'first rows are already stored is refused unless --allow-duplicates is given.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'log_files',
+            nargs='+',
+            type=str,
+            help="Log files to import ('-' reads stdin, .gz files are decompressed)"
+        )
+
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default='auto',
+            help='Line format; auto treats lines starting with { as JSON (default: auto)'
+        )
+
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Rows per bulk insert transaction (default: 5000)'
+        )
+
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=1,
+            help='Processes used to parse lines; 1 parses in this process (default: 1)'
+        )
+
+        parser.add_argument(
+            '--geolocate',
+            action='store_true',
+            help='Geolocate each batch before inserting it, one lookup per distinct IP'
+        )
+
+        parser.add_argument(
+            '--allow-duplicates',
+            action='store_true',
+            help='Import even if the first rows of a file are already stored'
+        )
+
+        parser.add_argument(
+            '--progress-interval',
+            type=float,
+            default=5.0,
+            help='Seconds between progress lines (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['workers'] < 1:
+            raise CommandError('--batch-size and --workers must be positive')
+
+        self.batch_size = options['batch_size']
+        self.geolocation_service = GeolocationService() if options['geolocate'] else None
+        self.allow_duplicates = options['allow_duplicates']
+        # Hours before this were rolled up already; the rollup task picks up the rest
+        self.watermark = rolled_up_until()
+        self.stats = {'lines': 0, 'imported': 0, 'invalid': 0, 'geolocated': 0, 'rolled_up': 0}
+        self.started = time.monotonic()
+        self.last_progress = self.started
+        self.progress_interval = options['progress_interval']
+
+        workers = options['workers']
+        pool = multiprocessing.Pool(workers) if workers > 1 else None
+        try:
+            for log_file in options['log_files']:
+                try:
+                    log = open_log(log_file)
+                except OSError as e:
+                    raise CommandError(f'Cannot open {log_file}: {e}')
+
+                with log as stream:
+                    self.import_stream(log_file, stream, options['format'], pool, workers)
+        finally:
+            if pool is not None:
+                pool.terminate()
+
+        elapsed = time.monotonic() - self.started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Import complete. {self.stats['imported']} rows imported from "
+                f"{self.stats['lines']} lines in {elapsed:.1f}s "
+                f"({self.stats['imported'] / max(elapsed, 1e-9):.0f} rows/s), "
+                f"{self.stats['invalid']} invalid lines skipped, "
+                f"{self.stats['geolocated']} IPs geolocated, "
+                f"{self.stats['rolled_up']} rows added to already rolled-up hours."
+            )
+        )
+
+    def import_stream(self, log_file, stream, log_format, pool, workers):
+        batch = []
+        checked = self.allow_duplicates
+        for parsed, invalid, line_count in parse_stream(stream, log_format, pool=pool, max_pending=workers * 2):
+            self.stats['lines'] += line_count
+            self.stats['invalid'] += invalid
+            for line in parsed:
+                batch.append(self.build_log_entry(line))
+                if not checked and len(batch) >= DUPLICATE_CHECK_ROWS:
+                    self.check_not_imported(log_file, batch)
+                    checked = True
+                if len(batch) >= self.batch_size:
+                    self.insert_batch(batch)
+                    batch = []
+            self.report_progress()
+
+        if batch:
+            if not checked:
+                self.check_not_imported(log_file, batch)
+            self.insert_batch(batch)
+
+    def check_not_imported(self, log_file, batch):
+        """Refuse a file whose first rows are already stored, so a re-import does not double count"""
+        sample = batch[:DUPLICATE_CHECK_ROWS]
+        stored = set(
+            RequestLog.objects
+            .filter(timestamp__in={entry.timestamp for entry in sample})
+            .values_list('ip_address', 'path', 'timestamp')
+        )
+        if any((entry.ip_address, entry.path, entry.timestamp) in stored for entry in sample):
+            raise CommandError(
+                f'{log_file} looks imported already: some of its first rows are stored. '
+                f'Importing it again would count its traffic twice; pass --allow-duplicates to import anyway.'
+            )
+
+    def build_log_entry(self, line):
+        """Unsaved RequestLog for a parsed line, classified the way the middleware does"""
+        timestamp = line.timestamp
+        if timezone.is_naive(timestamp):
+            timestamp = timezone.make_aware(timestamp)
+        # Rollup hours are UTC hours, whatever offset the log was written with
+        timestamp = timestamp.astimezone(dt_timezone.utc)
+
+        sensitive_category = sensitive_path_matcher.category(line.path)
+        geolocation_data = line.geolocation or {}
+        return RequestLog(
+            ip_address=line.ip_address,
+            path=line.path,
+            timestamp=timestamp,
+            is_sensitive=sensitive_category is not None,
+            sensitive_category=sensitive_category,
+            country=geolocation_data.get('country'),
+            city=geolocation_data.get('city'),
+            region=geolocation_data.get('region'),
+            geolocation_data=line.geolocation
+        )
+
+    def geolocate(self, batch):
+        """Fill in geolocation for rows that have none, with one batched lookup"""
+        pending = [entry for entry in batch if entry.geolocation_data is None]
+        if not pending:
+            return
+
+        geolocation = self.geolocation_service.get_geolocation_many(entry.ip_address for entry in pending)
+        self.stats['geolocated'] += len(geolocation)
+        for entry in pending:
+            # Failed lookups store the error payload too, so enrichment does not retry them
+            geolocation_data = geolocation[entry.ip_address]
+            entry.country = geolocation_data.get('country')
+            entry.city = geolocation_data.get('city')
+            entry.region = geolocation_data.get('region')
+            entry.latitude = geolocation_data.get('latitude')
+            entry.longitude = geolocation_data.get('longitude')
+            entry.geolocation_data = geolocation_data
+
+    def insert_batch(self, batch):
+        if self.geolocation_service:
+            self.geolocate(batch)
+
+        by_ip, by_country = self.rollup_deltas(batch)
+        with transaction.atomic():
+            RequestLog.objects.bulk_create(batch, batch_size=1000)
+            increment_counters(counter_deltas(batch))
+            add_to_rollups(RequestLogHourlyIP, 'ip_address', by_ip)
+            add_to_rollups(RequestLogHourlyCountry, 'country', by_country)
+
+        self.stats['imported'] += len(batch)
+
+    def rollup_deltas(self, batch):
+        """
+        Per-hour counts of the rows that fall in hours already rolled up. They
+        are added to the existing rollups rather than recomputing those hours,
+        whose raw rows may have been pruned.
+        """
+        by_ip = {}
+        by_country = {}
+        if self.watermark is None:
+            return by_ip, by_country
+
+        def add(counts, key, sensitive):
+            requests_so_far, sensitive_so_far = counts.get(key, (0, 0))
+            counts[key] = (requests_so_far + 1, sensitive_so_far + sensitive)
+
+        for entry in batch:
+            hour = floor_hour(entry.timestamp)
+            if hour >= self.watermark:
+                continue
+            self.stats['rolled_up'] += 1
+            add(by_ip, (hour, entry.ip_address), entry.is_sensitive)
+            if entry.country:
+                add(by_country, (hour, entry.country), entry.is_sensitive)
+        return by_ip, by_country
+
+    def report_progress(self):
+        now = time.monotonic()
+        if now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        elapsed = now - self.started
+        self.stdout.write(
+            f"{self.stats['imported']} rows imported, {self.stats['lines']} lines read "
+            f"({self.stats['imported'] / elapsed:.0f} rows/s), {self.stats['invalid']} invalid"
+        )
@@ -1,25 +1,120 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from ip_tracking.listing import OUTPUT_FORMATS, RowWriter, overlaps, parse_cidr_filter
 from ip_tracking.models import BlockedIP
+from ip_tracking.pagination import parse_aware_datetime
+
+FIELDS = ['ip_address', 'prefix_length', 'created_at', 'reason']
 
 class Command(BaseCommand):
-    help = 'List all blocked IP addresses'
+    help = 'List blocked IP addresses and networks'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reason',
+            type=str,
+            help='Only entries whose reason contains this text (case insensitive)'
+        )
+        
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Only entries blocked at or after this ISO 8601 time'
+        )
+        
+        parser.add_argument(
+            '--until',
+            type=str,
+            help='Only entries blocked before this ISO 8601 time'
+        )
+        
+        parser.add_argument(
+            '--cidr',
+            type=str,
+            help='Only entries overlapping this network, e.g. 203.0.113.0/24'
+        )
+        
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='List at most this many entries'
+        )
+        
+        parser.add_argument(
+            '--format',
+            choices=OUTPUT_FORMATS,
+            default='text',
+            help='Output format; csv and ndjson print rows only (default: text)'
+        )
     
     def handle(self, *args, **options):
-        blocked_ips = BlockedIP.objects.all()
+        try:
+            blocked_ips = self.filter_queryset(options)
+            network = parse_cidr_filter(options['cidr']) if options['cidr'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError('--limit must be positive')
+        
+        text = options['format'] == 'text'
+        writer = RowWriter(self.stdout, options['format'], FIELDS, self.format_text)
+        # Keep csv and ndjson output clean for pipelines
+        message_stream = self.stdout if text else self.stderr
+        # Totals come from one aggregate query, unless only Python can apply the CIDR filter
+        totals = None
+        if network is None:
+            totals = blocked_ips.aggregate(
+                total=Count('pk'),
+                networks=Count('pk', filter=Q(prefix_length__isnull=False)),
+            )
+            if not totals['total']:
+                message_stream.write(self.style.WARNING('No IP addresses are currently blocked.'))
+                return
+        
+        matched = networks = 0
+        rows = blocked_ips.order_by('pk').values(*FIELDS).iterator(chunk_size=2000)
+        for row in rows:
+            if network is not None:
+                if not overlaps(BlockedIP.to_network(row['ip_address'], row['prefix_length']), network):
+                    continue
+                matched += 1
+                networks += row['prefix_length'] is not None
+            if options['limit'] is None or writer.count < options['limit']:
+                if text and writer.count == 0:
+                    self.stdout.write(self.style.SUCCESS('Blocked IP addresses:'))
+                writer.write(row)
+            elif network is None:
+                break
         
-        if not blocked_ips:
-            self.stdout.write(self.style.WARNING('No IP addresses are currently blocked.'))
+        if totals is None:
+            totals = {'total': matched, 'networks': networks}
+        if not totals['total']:
+            message_stream.write(self.style.WARNING('No IP addresses are currently blocked.'))
             return
         
-        self.stdout.write(self.style.SUCCESS('Blocked IP addresses:'))
-        for blocked_ip in blocked_ips:
-            self.stdout.write(
-                f"  {blocked_ip.ip_address} - "
-                f"Blocked: {blocked_ip.created_at} - "
-                f"Reason: {blocked_ip.reason or 'No reason provided'}"
+        message_stream.write(
+            self.style.SUCCESS(
+                f"Total blocked IPs: {totals['total']} ({totals['networks']} networks), "
+                f"{writer.count} listed"
             )
-        
-        self.stdout.write(
-            self.style.SUCCESS(f'Total blocked IPs: {blocked_ips.count()}')
         )
-        
\ No newline at end of file
+    
+    def filter_queryset(self, options):
+        blocked_ips = BlockedIP.objects.all()
+        if options['reason']:
+            blocked_ips = blocked_ips.filter(reason__icontains=options['reason'])
+        if options['since']:
+            blocked_ips = blocked_ips.filter(created_at__gte=parse_aware_datetime(options['since']))
+        if options['until']:
+            blocked_ips = blocked_ips.filter(created_at__lt=parse_aware_datetime(options['until']))
+        return blocked_ips
+    
+    def format_text(self, row):
+        cidr = row['ip_address']
+        if row['prefix_length'] is not None:
+            cidr = f"{cidr}/{row['prefix_length']}"
+        return (
+            f"  {cidr} - "
+            f"Blocked: {row['created_at']} - "
+            f"Reason: {row['reason'] or 'No reason provided'}"
+        )
@@ -1,40 +1,146 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from ip_tracking.listing import OUTPUT_FORMATS, RowWriter, overlaps, parse_cidr_filter
 from ip_tracking.models import SuspiciousIP
+from ip_tracking.pagination import parse_aware_datetime
+import ipaddress
+
+FIELDS = ['id', 'ip_address', 'reason', 'request_count', 'detected_at', 'is_resolved', 'resolved_at', 'description']
+REASONS = dict(SuspiciousIP.REASON_CHOICES)
 
 class Command(BaseCommand):
-    help = 'List all suspicious IPs'
+    help = 'List suspicious IPs'
     
     def add_arguments(self, parser):
         parser.add_argument(
             '--resolved',
             action='store_true',
-            help='Include resolved suspicious IPs'
+            help='Include resolved suspicious IPs (same as --state all)'
+        )
+        
+        parser.add_argument(
+            '--state',
+            choices=['active', 'resolved', 'all'],
+            help='Which records to list by resolved state (default: active)'
+        )
+        
+        parser.add_argument(
+            '--reason',
+            choices=list(REASONS),
+            action='append',
+            help='Only records with this reason; may be repeated'
+        )
+        
+        parser.add_argument(
+            '--since',
+            type=str,
+            help='Only records detected at or after this ISO 8601 time'
+        )
+        
+        parser.add_argument(
+            '--until',
+            type=str,
+            help='Only records detected before this ISO 8601 time'
+        )
+        
+        parser.add_argument(
+            '--cidr',
+            type=str,
+            help='Only IPs inside this network, e.g. 203.0.113.0/24'
+        )
+        
+        parser.add_argument(
+            '--limit',
+            type=int,
+            help='List at most this many records, newest first'
+        )
+        
+        parser.add_argument(
+            '--format',
+            choices=OUTPUT_FORMATS,
+            default='text',
+            help='Output format; csv and ndjson print rows only (default: text)'
         )
     
     def handle(self, *args, **options):
-        include_resolved = options['resolved']
+        state = options['state'] or ('all' if options['resolved'] else 'active')
+        try:
+            suspicious_ips = self.filter_queryset(options, state)
+            network = parse_cidr_filter(options['cidr']) if options['cidr'] else None
+        except ValueError as e:
+            raise CommandError(str(e))
+        if options['limit'] is not None and options['limit'] < 1:
+            raise CommandError('--limit must be positive')
         
-        if include_resolved:
-            suspicious_ips = SuspiciousIP.objects.all()
-        else:
-            suspicious_ips = SuspiciousIP.objects.filter(is_resolved=False)
+        if network is not None and network.num_addresses == 1:
+            # A single address needs no Python-side filtering
+            suspicious_ips = suspicious_ips.filter(ip_address=str(network.network_address))
+            network = None
         
-        if not suspicious_ips:
-            self.stdout.write(self.style.WARNING('No suspicious IPs found.'))
+        text = options['format'] == 'text'
+        writer = RowWriter(self.stdout, options['format'], FIELDS, self.format_text)
+        # Keep csv and ndjson output clean for pipelines
+        message_stream = self.stdout if text else self.stderr
+        # Totals come from one aggregate query, unless only Python can apply the CIDR filter
+        totals = None
+        if network is None:
+            totals = suspicious_ips.aggregate(
+                total=Count('pk'),
+                active=Count('pk', filter=Q(is_resolved=False)),
+            )
+            if not totals['total']:
+                message_stream.write(self.style.WARNING('No suspicious IPs found.'))
+                return
+        
+        matched = active = 0
+        rows = suspicious_ips.order_by('-detected_at', '-pk').values(*FIELDS).iterator(chunk_size=2000)
+        for row in rows:
+            if network is not None:
+                if not overlaps(ipaddress.ip_network(row['ip_address']), network):
+                    continue
+                matched += 1
+                active += not row['is_resolved']
+            if options['limit'] is None or writer.count < options['limit']:
+                if text and writer.count == 0:
+                    self.stdout.write(self.style.SUCCESS('Suspicious IP addresses:'))
+                writer.write(row)
+            elif network is None:
+                break
+        
+        if totals is None:
+            totals = {'total': matched, 'active': active}
+        if not totals['total']:
+            message_stream.write(self.style.WARNING('No suspicious IPs found.'))
             return
         
-        self.stdout.write(self.style.SUCCESS('Suspicious IP addresses:'))
-        for suspicious_ip in suspicious_ips:
-            status = "RESOLVED" if suspicious_ip.is_resolved else "ACTIVE"
-            self.stdout.write(
-                f"  {suspicious_ip.ip_address} - "
-                f"{suspicious_ip.get_reason_display()} - "
-                f"Requests: {suspicious_ip.request_count} - "
-                f"Detected: {suspicious_ip.detected_at} - "
-                f"Status: {status}"
+        message_stream.write(
+            self.style.SUCCESS(
+                f"Total suspicious IPs: {totals['total']} ({totals['active']} active), "
+                f"{writer.count} listed"
             )
-            self.stdout.write(f"    Description: {suspicious_ip.description}")
-        
-        self.stdout.write(
-            self.style.SUCCESS(f'Total suspicious IPs: {suspicious_ips.count()}')
-        )
\ No newline at end of file
+        )
+    
+    def filter_queryset(self, options, state):
+        suspicious_ips = SuspiciousIP.objects.all()
+        if state == 'active':
+            suspicious_ips = suspicious_ips.filter(is_resolved=False)
+        elif state == 'resolved':
+            suspicious_ips = suspicious_ips.filter(is_resolved=True)
+        if options['reason']:
+            suspicious_ips = suspicious_ips.filter(reason__in=options['reason'])
+        if options['since']:
+            suspicious_ips = suspicious_ips.filter(detected_at__gte=parse_aware_datetime(options['since']))
+        if options['until']:
+            suspicious_ips = suspicious_ips.filter(detected_at__lt=parse_aware_datetime(options['until']))
+        return suspicious_ips
+    
+    def format_text(self, row):
+        status = "RESOLVED" if row['is_resolved'] else "ACTIVE"
+        return (
+            f"  {row['ip_address']} - "
+            f"{REASONS.get(row['reason'], row['reason'])} - "
+            f"Requests: {row['request_count']} - "
+            f"Detected: {row['detected_at']} - "
+            f"Status: {status}\n"
+            f"    Description: {row['description']}"
+        )
@@ -1,16 +1,80 @@
-from django.core.management.base import BaseCommand
-from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.rate_limit_index import collect_rate_limit_index
+from ip_tracking.rate_limits import get_policies, get_rate_limit_settings
+import json
+import time
 
 class Command(BaseCommand):
-    help = 'Show current rate limit status'
+    help = 'Show configured rate limits, rejection totals and the most throttled keys per group'
+    
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=10,
+            help='Keys to list per group (default: 10)'
+        )
+        
+        parser.add_argument(
+            '--group',
+            type=str,
+            help='Only show this group'
+        )
+        
+        parser.add_argument(
+            '--json',
+            action='store_true',
+            help='Print the merged index as JSON'
+        )
     
     def handle(self, *args, **options):
-        # This would need a more sophisticated implementation
-        # to properly inspect rate limit keys in cache
+        if options['top'] < 0:
+            raise CommandError('--top cannot be negative')
+        
+        index = collect_rate_limit_index(top=options['top'])
+        groups = index['groups']
+        keys = index['keys']
+        if options['group']:
+            groups = {name: totals for name, totals in groups.items() if name == options['group']}
+            keys = {name: entries for name, entries in keys.items() if name == options['group']}
+        
+        if options['json']:
+            self.stdout.write(json.dumps({'groups': groups, 'keys': keys}, indent=2))
+            return
+        
+        config = get_rate_limit_settings()
         self.stdout.write(
-            self.style.SUCCESS('Rate limiting is configured and active')
+            self.style.SUCCESS(f"Rate limiting store: {config['STORE']}, default algorithm: {config['ALGORITHM']}")
         )
         self.stdout.write('Configured limits:')
-        self.stdout.write('  - Anonymous users: 5 requests/minute')
-        self.stdout.write('  - Authenticated users: 10 requests/minute')
-        self.stdout.write('  - API endpoints: 10 requests/minute per IP')
\ No newline at end of file
+        for name, rules in sorted(get_policies().items()):
+            for rule in rules:
+                methods = ','.join(sorted(rule.methods)) if rule.methods else 'ALL'
+                users = f', {rule.users} users' if rule.users else ''
+                self.stdout.write(
+                    f"  - {name}: {rule.limiter.rate} per {rule.key_function.__name__}, "
+                    f"group {rule.group}, methods {methods}{users}{'' if rule.block else ', not blocking'}"
+                )
+        
+        if not groups:
+            self.stdout.write('No rate-limited requests recorded by running workers.')
+            return
+        
+        now = time.time()
+        for group, totals in sorted(groups.items(), key=lambda item: item[1]['rejected'], reverse=True):
+            rejected_share = totals['rejected'] / totals['requests'] if totals['requests'] else 0
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING(
+                f"{group}: {totals['requests']} requests, {totals['rejected']} rejected ({rejected_share:.1%})"
+            ))
+            for entry in keys.get(group, []):
+                # Usage only counts while the window it was reported in lasts
+                used = entry['used'] if entry['reset_at'] > now else 0
+                last_limited = (
+                    f"{now - entry['last_limited_at']:.0f}s ago" if entry['last_limited_at'] else 'never'
+                )
+                self.stdout.write(
+                    f"  {entry['key']:<40} {used}/{entry['limit']} "
+                    f"({used / entry['limit'] if entry['limit'] else 0:.0%})  "
+                    f"rejected {entry['rejected']}/{entry['requests']}, last limited {last_limited}"
+                )
@@ -0,0 +1,127 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+import django
+import json
+import platform
+import subprocess
+import time
+
+class Command(BaseCommand):
+    help = 'Benchmark the middleware, geolocation and detection hot paths against a throwaway test database'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--blocklist-sizes',
+            type=str,
+            default='0,10000,1000000',
+            help='Comma separated BlockedIP counts for the middleware benchmark (default: 0,10000,1000000)'
+        )
+
+        parser.add_argument(
+            '--rows',
+            type=str,
+            default='10000',
+            help='Comma separated RequestLog sizes for the detection benchmarks, e.g. 10000,1000000,10000000 (default: 10000)'
+        )
+
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=2000,
+            help='Calls timed per per-request benchmark (default: 2000)'
+        )
+
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Runs of each task-level benchmark (default: 3)'
+        )
+
+        parser.add_argument(
+            '--only',
+            choices=['middleware', 'geolocation', 'detection'],
+            action='append',
+            help='Run only the given benchmark group (repeatable)'
+        )
+
+        parser.add_argument(
+            '--output',
+            type=str,
+            default='benchmark_results.json',
+            help="Where to write the JSON results, '-' for stdout (default: benchmark_results.json)"
+        )
+
+        parser.add_argument(
+            '--keepdb',
+            action='store_true',
+            help='Keep the test database between runs'
+        )
+
+    def handle(self, *args, **options):
+        try:
+            blocklist_sizes = [int(size) for size in options['blocklist_sizes'].split(',') if size]
+            row_counts = [int(rows) for rows in options['rows'].split(',') if rows]
+        except ValueError:
+            raise CommandError('--blocklist-sizes and --rows take comma separated integers')
+
+        groups = options['only'] or ['middleware', 'geolocation', 'detection']
+        started = time.monotonic()
+
+        setup_test_environment()
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, keepdb=options['keepdb'])
+        try:
+            # Imported once the test database is in place, so module-level state binds to it
+            from ip_tracking import benchmarks
+
+            results = []
+            if 'middleware' in groups:
+                self.stdout.write('Benchmarking middleware...')
+                results += benchmarks.bench_middleware(blocklist_sizes, options['iterations'])
+            if 'geolocation' in groups:
+                self.stdout.write('Benchmarking geolocation...')
+                results += benchmarks.bench_geolocation(options['iterations'])
+            if 'detection' in groups:
+                self.stdout.write('Benchmarking detection...')
+                results += benchmarks.bench_detection(row_counts, options['repeat'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        report = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'platform': platform.platform(),
+                'git_revision': self.git_revision(),
+                'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'duration_seconds': round(time.monotonic() - started, 3),
+            },
+            'results': results,
+        }
+
+        for result in results:
+            params = ', '.join(f'{key}={value}' for key, value in result['params'].items())
+            self.stdout.write(
+                f"{result['name']:<28} {params:<40} "
+                f"p50 {result['p50']:>12.3f}{result['unit']}  max {result['max']:>12.3f}{result['unit']}"
+            )
+
+        if options['output'] == '-':
+            self.stdout.write(json.dumps(report, indent=2))
+        else:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+
+    def git_revision(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', 'HEAD'],
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
@@ -1,40 +1,57 @@
-from django.core.management.base import BaseCommand
-from ip_tracking.models import BlockedIP
+from django.core.management.base import BaseCommand, CommandError
+from ip_tracking.blocklist_import import Throughput, clean_batches, read_values, unblock_many
 
 class Command(BaseCommand):
-    help = 'Remove IP addresses from the blocklist'
+    help = 'Remove IP addresses and CIDR networks from the blocklist'
     
     def add_arguments(self, parser):
         parser.add_argument(
             'ip_addresses',
-            nargs='+',
+            nargs='*',
             type=str,
-            help='IP addresses to unblock (space separated)'
+            help='IP addresses or CIDR networks to unblock (space separated)'
+        )
+        
+        parser.add_argument(
+            '--file',
+            dest='files',
+            action='append',
+            default=[],
+            help="Read one address or CIDR per line from this file ('-' reads stdin); may be repeated"
+        )
+        
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=5000,
+            help='Entries deleted per transaction (default: 5000)'
         )
     
     def handle(self, *args, **options):
-        ip_addresses = options['ip_addresses']
-        
-        unblocked_count = 0
-        not_found_count = 0
+        if not options['ip_addresses'] and not options['files']:
+            raise CommandError('Give IP addresses, networks or --file')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
         
-        for ip_str in ip_addresses:
-            deleted_count, _ = BlockedIP.objects.filter(ip_address=ip_str).delete()
-            
-            if deleted_count > 0:
-                self.stdout.write(
-                    self.style.SUCCESS(f'Successfully unblocked IP: {ip_str}')
-                )
-                unblocked_count += 1
-            else:
-                self.stdout.write(
-                    self.style.WARNING(f'IP not found in blocklist: {ip_str}')
-                )
-                not_found_count += 1
+        self.invalid_count = 0
+        throughput = Throughput()
+        try:
+            stats = unblock_many(clean_batches(
+                read_values(options['ip_addresses'], options['files']),
+                options['batch_size'],
+                on_invalid=self.report_invalid
+            ))
+        except OSError as e:
+            raise CommandError(f'Cannot read blocklist file: {e}')
         
         self.stdout.write(
             self.style.SUCCESS(
-                f'Unblocking complete. {unblocked_count} IPs unblocked, '
-                f'{not_found_count} IPs not found in blocklist.'
+                f"Unblocking complete. {stats['deleted']} entries unblocked, "
+                f"{stats['not_found']} not found in blocklist, {self.invalid_count} invalid."
             )
-        )
\ No newline at end of file
+        )
+        self.stdout.write(f"Processed {throughput.report(stats['seen'] + self.invalid_count)}")
+    
+    def report_invalid(self, value, error):
+        self.invalid_count += 1
+        self.stderr.write(self.style.ERROR(f'Invalid IP address or network: {value}'))
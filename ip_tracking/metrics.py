@@ -0,0 +1,232 @@
+"""
+In-process latency histograms and counters, rendered in Prometheus text format.
+
+Hot paths call ``metrics.observe``/``metrics.inc`` or wrap a stage in
+``metrics.timer``; each is a dict update under one lock. Modules that
+already keep their own counters (the log writer, the geolocation cache,
+the circuit breakers) register a collector that is read only at scrape time.
+
+With METRICS['AGGREGATE_PROCESSES'] each worker publishes its snapshot to
+the shared cache and the metrics endpoint sums the counters and histograms
+of all live workers, the same way the anomaly-detection window counters are
+merged. Gauges describe one process, so they are exported per worker.
+"""
+import bisect
+import contextlib
+import threading
+import time
+
+from django.conf import settings
+
+from .worker_snapshots import get_worker_id, worker_publisher
+
+# Seconds; spans a local-cache hit (~10µs) up to a provider timeout
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+def get_metrics_settings():
+    """Metrics settings with defaults applied"""
+    config = {
+        'ENABLED': True,
+        'AGGREGATE_PROCESSES': False,  # Sum every worker's metrics at the endpoint
+        'PUBLISH_INTERVAL': 10,        # Seconds between publishing this worker's snapshot
+        'BUCKETS': DEFAULT_BUCKETS,
+        'ALLOWED_IPS': ['127.0.0.1', '::1'],  # Addresses and CIDRs that may read the endpoint
+        'TOKEN': None,                 # Or send 'Authorization: Bearer <TOKEN>'; staff users are always allowed
+    }
+    config.update(getattr(settings, 'METRICS', {}))
+    return config
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class MetricsRegistry:
+    """Counters, gauges and fixed-bucket histograms keyed by (name, labels)"""
+
+    def __init__(self, enabled=True, buckets=DEFAULT_BUCKETS, aggregate=False, publish_interval=10):
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+        self.aggregate = aggregate
+        self.publish_interval = publish_interval
+
+        self._types = {}       # name -> (type, help)
+        self._values = {}      # (name, labels) -> number, for counters
+        self._histograms = {}  # (name, labels) -> [count per bucket..., overflow, sum]
+        self._collectors = []
+        self._lock = threading.Lock()
+        self.publisher = worker_publisher.register('ip_metrics', self.snapshot, publish_interval, on_fork=self._reset)
+
+    def counter(self, name, help_text):
+        self._types[name] = ('counter', help_text)
+
+    def gauge(self, name, help_text):
+        self._types[name] = ('gauge', help_text)
+
+    def histogram(self, name, help_text):
+        self._types[name] = ('histogram', help_text)
+
+    def register_collector(self, collector):
+        """collector() yields (name, labels, value) samples, read at scrape time"""
+        self._collectors.append(collector)
+
+    def inc(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        if self.aggregate:
+            self.publisher.ensure_started()
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        if not self.enabled:
+            return
+        if self.aggregate:
+            self.publisher.ensure_started()
+        key = (name, _label_key(labels))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._histograms.get(key)
+            if counts is None:
+                counts = self._histograms[key] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        """Observe how long the block takes, in seconds, exceptions included"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        """Picklable copy of every metric, collectors included"""
+        with self._lock:
+            values = dict(self._values)
+            histograms = {key: list(counts) for key, counts in self._histograms.items()}
+
+        for collector in self._collectors:
+            try:
+                for name, labels, value in collector():
+                    values[(name, _label_key(labels))] = value
+            except Exception as e:
+                print(f"Error collecting metrics: {e}")
+
+        return {
+            'worker': get_worker_id(),
+            'types': dict(self._types),
+            'buckets': self.buckets,
+            'values': values,
+            'histograms': histograms,
+        }
+
+    def _reset(self):
+        # Samples copied from the parent belong to the parent
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+
+def merge_snapshots(snapshots):
+    """
+    Sum counters and histograms across snapshots. Summing or averaging
+    gauges such as circuit_open would hide which worker they describe, so
+    each worker's gauges are kept with a worker label.
+    """
+    merged = {'types': {}, 'buckets': metrics.buckets, 'values': {}, 'histograms': {}}
+    for snapshot in snapshots:
+        merged['types'].update(snapshot['types'])
+        for (name, labels), value in snapshot['values'].items():
+            if snapshot['types'].get(name, ('counter',))[0] == 'gauge':
+                merged['values'][(name, labels + (('worker', snapshot['worker']),))] = value
+                continue
+            key = (name, labels)
+            merged['values'][key] = merged['values'].get(key, 0) + value
+        if tuple(snapshot['buckets']) != tuple(merged['buckets']):
+            # Workers running with other buckets cannot be summed bucket by bucket
+            continue
+        for key, counts in snapshot['histograms'].items():
+            total = merged['histograms'].get(key)
+            if total is None:
+                merged['histograms'][key] = list(counts)
+            else:
+                merged['histograms'][key] = [a + b for a, b in zip(total, counts)]
+    return merged
+
+
+def collect_metrics():
+    """
+    Metrics for the endpoint: this process only, or with AGGREGATE_PROCESSES
+    the sum of every live worker's published snapshot, this one refreshed first.
+    """
+    if not metrics.aggregate:
+        return metrics.snapshot()
+
+    metrics.publisher.publish()
+    return merge_snapshots(metrics.publisher.collect())
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render_prometheus(snapshot):
+    """Prometheus text exposition format (version 0.0.4) for a snapshot"""
+    by_name = {}
+    for (name, labels), value in snapshot['values'].items():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), counts in snapshot['histograms'].items():
+        by_name.setdefault(name, []).append((labels, counts))
+
+    lines = []
+    for name in sorted(by_name):
+        metric_type, help_text = snapshot['types'].get(name, ('untyped', ''))
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        for labels, value in sorted(by_name[name], key=lambda sample: sample[0]):
+            if metric_type != 'histogram':
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+                continue
+
+            cumulative = 0
+            for bound, count in zip(snapshot['buckets'], value):
+                cumulative += count
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", repr(float(bound)))])} {cumulative}')
+            cumulative += value[-2]
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {cumulative}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{_format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+_config = get_metrics_settings()
+
+# Shared by the middleware, geolocation, log writer and rate limiting in this process
+metrics = MetricsRegistry(
+    enabled=_config['ENABLED'],
+    buckets=_config['BUCKETS'],
+    aggregate=_config['AGGREGATE_PROCESSES'],
+    publish_interval=_config['PUBLISH_INTERVAL'],
+)
+
+metrics.histogram('ip_tracking_middleware_stage_seconds', 'Time spent in each IPLoggingMiddleware stage')
+metrics.histogram('ip_tracking_geolocation_provider_seconds', 'Geolocation provider call latency')
+metrics.counter('ip_tracking_geolocation_provider_failures_total', 'Geolocation provider calls that failed or found nothing')
+metrics.counter('ip_tracking_geolocation_lookups_total', 'Geolocation lookups by where the answer came from')
+metrics.histogram('ip_tracking_rate_limit_decision_seconds', 'Time spent deciding whether a request is rate limited')
+metrics.counter('ip_tracking_rate_limit_rejections_total', 'Requests rejected by rate limiting')
+metrics.counter('ip_tracking_rate_limit_store_full_total', 'Requests whose key found no free shared memory slot, by WHEN_STORE_FULL outcome')
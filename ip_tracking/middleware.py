@@ -1,104 +1,139 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import HttpResponseForbidden
-from .models import RequestLog, BlockedIP
+from .models import RequestLog
 from .geolocation import GeolocationService
+from .blocklist import blocklist_index
+from .log_writer import request_log_writer
+from .metrics import metrics
+from .path_classifier import sensitive_path_matcher
+from .window_counters import get_window_settings, window_counters
+
+STAGE_SECONDS = 'ip_tracking_middleware_stage_seconds'
 
 class IPLoggingMiddleware:
+    # Runs natively under both WSGI and ASGI, so no thread is spent on it under uvicorn
+    sync_capable = True
+    async_capable = True
+    
     def __init__(self, get_response):
         self.get_response = get_response
-         self.geolocation_service = GeolocationService()
+        self.geolocation_service = GeolocationService()
+        self.blocklist = blocklist_index
+        self.log_writer = request_log_writer
+        self.path_matcher = sensitive_path_matcher
+        self.counters = window_counters if get_window_settings()['WINDOW_COUNTERS'] else None
+        self.async_mode = iscoroutinefunction(self.get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
     
     def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        
         # Check if IP is blocked BEFORE processing the request
-        if self.is_ip_blocked(request):
+        with metrics.timer(STAGE_SECONDS, stage='block_check'):
+            blocked = self.is_ip_blocked(request)
+        if blocked:
             return HttpResponseForbidden("IP address blocked")
         
         # Process the request and get the response
-        response = self.get_response(request)
+        with metrics.timer(STAGE_SECONDS, stage='response'):
+            response = self.get_response(request)
         
         # Log the request details after getting the response
         self.log_request(request)
         
         return response
     
+    async def __acall__(self, request):
+        """Async counterpart of __call__ used when the handler stack is async"""
+        with metrics.timer(STAGE_SECONDS, stage='block_check'):
+            blocked = await self.ais_ip_blocked(request)
+        if blocked:
+            return HttpResponseForbidden("IP address blocked")
+        
+        with metrics.timer(STAGE_SECONDS, stage='response'):
+            response = await self.get_response(request)
+        
+        await self.alog_request(request)
+        
+        return response
+    
     def is_ip_blocked(self, request):
-        """Check if the client IP is in the blocked list"""
+        """Check if the client IP is blocked, exactly or by a blocked network"""
         try:
             ip_address = self.get_client_ip(request)
-            return BlockedIP.objects.filter(ip_address=ip_address).exists()
+            return self.blocklist.contains(ip_address)
         except Exception as e:
             # If there's an error checking, allow the request (fail open)
             print(f"Error checking IP block: {e}")
             return False
     
-
-        def get_geolocation_data(self, ip_address):
-        """Get geolocation data for IP with 24-hour caching"""
-        cache_key = f"ip_geolocation_{ip_address}"
-        
-        # Try to get from cache first
-        cached_data = cache.get(cache_key)
-        if cached_data:
-            return cached_data
-        
+    async def ais_ip_blocked(self, request):
+        """Async block check; only a due index refresh is moved off the event loop"""
         try:
-            # Get geolocation using django-ipgeolocation
-            geolocator = Geolocation()
-            geo_data = geolocator.get_geolocation(ip=ip_address)
-            
-            # Extract relevant fields
-            processed_data = {
-                'country': geo_data.get('country'),
-                'country_code': geo_data.get('country_code'),
-                'city': geo_data.get('city'),
-                'region': geo_data.get('region'),
-                'latitude': geo_data.get('latitude'),
-                'longitude': geo_data.get('longitude'),
-                'timezone': geo_data.get('timezone'),
-                'isp': geo_data.get('isp'),
-                'raw_data': geo_data  # Store complete response
-            }
-            
-            # Cache for 24 hours (86400 seconds)
-            cache.set(cache_key, processed_data, 86400)
-            
-            return processed_data
-            
+            ip_address = self.get_client_ip(request)
+            return await self.blocklist.acontains(ip_address)
         except Exception as e:
-            # Return empty data if geolocation fails
-            print(f"Geolocation error for IP {ip_address}: {e}")
-            return {
-                'country': None,
-                'city': None,
-                'region': None,
-                'latitude': None,
-                'longitude': None,
-                'error': str(e)
-            }
-
+            print(f"Error checking IP block: {e}")
+            return False
+    
     def log_request(self, request):
         """Extract and log IP address, timestamp, path, and geolocation"""
         try:
             # Get client IP address
             ip_address = self.get_client_ip(request)
             
-            # Get geolocation data using our enhanced service
-            geolocation_data = self.geolocation_service.get_geolocation(ip_address)
+            # Use cached geolocation only; misses are backfilled later by the
+            # enrich_request_log_geolocation task instead of blocking the response
+            with metrics.timer(STAGE_SECONDS, stage='geo_cache'):
+                geolocation_data = self.geolocation_service.get_cached_geolocation(ip_address)
             
-            # Create and save the log entry
-            RequestLog.objects.create(
-                ip_address=ip_address,
-                path=request.path,
-                country=geolocation_data.get('country'),
-                city=geolocation_data.get('city'),
-                region=geolocation_data.get('region'),
-                latitude=geolocation_data.get('latitude'),
-                longitude=geolocation_data.get('longitude'),
-                geolocation_data=geolocation_data
-            )
+            # Queue the log entry; it is written in the next bulk flush
+            with metrics.timer(STAGE_SECONDS, stage='log_write'):
+                entry = self.build_log_entry(request, ip_address, geolocation_data)
+                self.log_writer.write(entry)
+            
+            # Feed the sliding windows that anomaly detection reads
+            if self.counters:
+                with metrics.timer(STAGE_SECONDS, stage='window_counters'):
+                    self.counters.record(ip_address, entry.path, entry.is_sensitive)
         except Exception as e:
             # Log the error but don't break the application
             print(f"Error logging request: {e}")
     
+    async def alog_request(self, request):
+        """Async counterpart of log_request; queues the entry without waiting on the database"""
+        try:
+            ip_address = self.get_client_ip(request)
+            with metrics.timer(STAGE_SECONDS, stage='geo_cache'):
+                geolocation_data = await self.geolocation_service.aget_cached_geolocation(ip_address)
+            with metrics.timer(STAGE_SECONDS, stage='log_write'):
+                entry = self.build_log_entry(request, ip_address, geolocation_data)
+                await self.log_writer.awrite(entry)
+            if self.counters:
+                with metrics.timer(STAGE_SECONDS, stage='window_counters'):
+                    self.counters.record(ip_address, entry.path, entry.is_sensitive)
+        except Exception as e:
+            print(f"Error logging request: {e}")
+    
+    def build_log_entry(self, request, ip_address, geolocation_data):
+        """Unsaved RequestLog for a request and whatever geolocation is known"""
+        geolocation_data = geolocation_data or {}
+        sensitive_category = self.path_matcher.category(request.path)
+        return RequestLog(
+            ip_address=ip_address,
+            path=request.path,
+            is_sensitive=sensitive_category is not None,
+            sensitive_category=sensitive_category,
+            country=geolocation_data.get('country'),
+            city=geolocation_data.get('city'),
+            region=geolocation_data.get('region'),
+            latitude=geolocation_data.get('latitude'),
+            longitude=geolocation_data.get('longitude'),
+            geolocation_data=geolocation_data or None
+        )
+    
     def get_client_ip(self, request):
         """Extract client IP address, handling proxy headers"""
         x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
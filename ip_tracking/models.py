@@ -1,12 +1,19 @@
+import ipaddress
+
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 # Create your models here.
-from django.db import models
 
 class RequestLog(models.Model):
     ip_address = models.GenericIPAddressField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the row is built, not when a buffered batch is written
+    timestamp = models.DateTimeField(default=timezone.now)
     path = models.CharField(max_length=255)
+    # Classified at ingest against ANOMALY_DETECTION['SENSITIVE_PATHS']
+    is_sensitive = models.BooleanField(default=False)
+    sensitive_category = models.CharField(max_length=100, blank=True, null=True)
 
     # Geolocation fields
     country = models.CharField(max_length=100, blank=True, null=True)
@@ -19,10 +26,17 @@ class RequestLog(models.Model):
     class Meta:
         db_table = 'request_logs'
         ordering = ['-timestamp']
-                indexes = [
+        indexes = [
             models.Index(fields=['ip_address', 'timestamp']),
             models.Index(fields=['timestamp']),
             models.Index(fields=['path']),
+            models.Index(fields=['is_sensitive', 'timestamp']),
+            # Rows still waiting for geolocation enrichment
+            models.Index(
+                fields=['ip_address'],
+                condition=models.Q(geolocation_data__isnull=True),
+                name='request_logs_pending_geo_idx',
+            ),
         ]
     
     def __str__(self):
@@ -31,7 +45,9 @@ class RequestLog(models.Model):
 
 
 class BlockedIP(models.Model):
-    ip_address = models.GenericIPAddressField(unique=True)
+    ip_address = models.GenericIPAddressField()
+    # Set to block a whole network; ip_address then holds the network address
+    prefix_length = models.PositiveSmallIntegerField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     reason = models.TextField(blank=True, null=True)
     
@@ -39,12 +55,58 @@ class BlockedIP(models.Model):
         db_table = 'blocked_ips'
         verbose_name = 'Blocked IP'
         verbose_name_plural = 'Blocked IPs'
+        # A host and a network starting at the same address are separate entries.
+        # NULLs never conflict in a unique constraint, so hosts need their own.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['ip_address', 'prefix_length'],
+                name='blocked_ips_unique_network',
+            ),
+            models.UniqueConstraint(
+                fields=['ip_address'],
+                condition=models.Q(prefix_length__isnull=True),
+                name='blocked_ips_unique_host',
+            ),
+        ]
     
     def __str__(self):
-        return f"{self.ip_address} - {self.created_at}"
+        return f"{self.cidr} - {self.created_at}"
+    
+    @staticmethod
+    def to_network(ip_address, prefix_length=None):
+        """Build an ip_network from a stored address and optional prefix length"""
+        if prefix_length is None:
+            return ipaddress.ip_network(ip_address)
+        return ipaddress.ip_network(f"{ip_address}/{prefix_length}")
+    
+    @classmethod
+    def from_network(cls, value, **kwargs):
+        """Build an unsaved instance from an address or CIDR string"""
+        from .blocklist import parse_network
+        network = parse_network(value)
+        prefix_length = network.prefixlen if network.num_addresses > 1 else None
+        return cls(ip_address=str(network.network_address), prefix_length=prefix_length, **kwargs)
+    
+    @property
+    def network(self):
+        return self.to_network(self.ip_address, self.prefix_length)
+    
+    @property
+    def cidr(self):
+        if self.prefix_length is None:
+            return self.ip_address
+        return f"{self.ip_address}/{self.prefix_length}"
+    
+    def clean(self):
+        try:
+            network = self.network
+        except ValueError as e:
+            raise ValidationError({'prefix_length': str(e)})
+        if network.num_addresses == 1:
+            self.prefix_length = None
 
 
-lass SuspiciousIP(models.Model):
+class SuspiciousIP(models.Model):
     REASON_CHOICES = [
         ('high_volume', 'High request volume'),
         ('sensitive_access', 'Access to sensitive paths'),
@@ -67,6 +129,8 @@ lass SuspiciousIP(models.Model):
         indexes = [
             models.Index(fields=['ip_address', 'detected_at']),
             models.Index(fields=['is_resolved']),
+            # Newest-first pages of open suspicions for suspicious_ips_view
+            models.Index(fields=['is_resolved', 'detected_at']),
         ]
     
     def __str__(self):
@@ -76,4 +140,62 @@ lass SuspiciousIP(models.Model):
         self.is_resolved = True
         from django.utils import timezone
         self.resolved_at = timezone.now()
-        self.save()
\ No newline at end of file
+        self.save()
+
+
+class RequestLogHourlyIP(models.Model):
+    """Hourly request totals per IP, folded from RequestLog by the rollup task"""
+    ip_address = models.GenericIPAddressField()
+    hour = models.DateTimeField()
+    request_count = models.IntegerField(default=0)
+    sensitive_count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'request_log_hourly_ip'
+        unique_together = [('ip_address', 'hour')]
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+    
+    def __str__(self):
+        return f"{self.ip_address} - {self.hour} - {self.request_count}"
+
+
+class RequestLogHourlyCountry(models.Model):
+    """Hourly request totals per located country, folded from RequestLog"""
+    country = models.CharField(max_length=100, blank=True, default='')
+    hour = models.DateTimeField()
+    request_count = models.IntegerField(default=0)
+    sensitive_count = models.IntegerField(default=0)
+    
+    class Meta:
+        db_table = 'request_log_hourly_country'
+        unique_together = [('country', 'hour')]
+        indexes = [
+            models.Index(fields=['hour']),
+        ]
+    
+    def __str__(self):
+        return f"{self.country or 'Unknown'} - {self.hour} - {self.request_count}"
+
+
+class RequestLogCounter(models.Model):
+    """Running request totals, incremented as logs are written and enriched"""
+    KIND_CHOICES = [
+        ('total', 'All requests'),
+        ('country', 'Requests per country'),
+        ('city', 'Requests per city'),
+    ]
+    
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    country = models.CharField(max_length=100, blank=True, default='')
+    city = models.CharField(max_length=100, blank=True, default='')
+    count = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'request_log_counters'
+        unique_together = [('kind', 'country', 'city')]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} {self.city or self.country} - {self.count}"
@@ -0,0 +1,33 @@
+import re
+
+from django.conf import settings
+
+
+class SensitivePathMatcher:
+    """
+    Classifies request paths against ANOMALY_DETECTION['SENSITIVE_PATHS'].
+    All prefixes are compiled into one anchored regex, longest first, so a
+    single match call finds the most specific prefix.
+    """
+
+    def __init__(self, prefixes):
+        self.prefixes = sorted(set(prefixes), key=len, reverse=True)
+        if self.prefixes:
+            self._regex = re.compile('|'.join(re.escape(prefix) for prefix in self.prefixes))
+        else:
+            self._regex = None
+
+    def category(self, path):
+        """The sensitive prefix the path falls under, or None"""
+        if self._regex is None:
+            return None
+        match = self._regex.match(path)
+        return match.group(0) if match else None
+
+    def is_sensitive(self, path):
+        return self.category(path) is not None
+
+
+sensitive_path_matcher = SensitivePathMatcher(
+    getattr(settings, 'ANOMALY_DETECTION', {}).get('SENSITIVE_PATHS', [])
+)
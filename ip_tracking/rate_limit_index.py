@@ -0,0 +1,163 @@
+"""
+Index of the keys the rate limiter has seen recently, for rate_limit_status.
+
+Limiter counters live in the store under hashed keys, which cannot be
+listed. So each process also records every decision here: per-group
+request and rejection totals, plus a bounded LRU of active keys with the
+usage reported by their last decision and when they were last limited.
+
+Each process publishes a compact snapshot (its totals and its most
+throttled keys) through the worker publisher; collect_rate_limit_index()
+merges them.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+
+from .worker_snapshots import worker_publisher
+
+
+def get_index_settings():
+    """Active-key index settings from RATE_LIMITS, with defaults applied"""
+    config = {
+        'INDEX_MAX_KEYS': 10000,        # Keys remembered per process, least recently seen dropped first
+        'INDEX_TOP_KEYS': 100,          # Keys per group published to the shared cache
+        'INDEX_PUBLISH_INTERVAL': 10,   # Seconds between publishes
+    }
+    config.update(getattr(settings, 'RATE_LIMITS', {}))
+    return config
+
+
+class RateLimitIndex:
+    """Per-process totals per group and an LRU of active (group, key) entries"""
+
+    def __init__(self, max_keys=10000, top_keys=100, publish_interval=10):
+        self.max_keys = max_keys
+        self.top_keys = top_keys
+        self.publish_interval = publish_interval
+
+        self._groups = {}  # group -> [requests, rejected]
+        # (group, key) -> [used, limit, reset_at, requests, rejected, last_limited_at, last_seen]
+        self._keys = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.publisher = worker_publisher.register('rate_limit_index', self.snapshot, publish_interval, on_fork=self._reset)
+
+    def record(self, group, key, decision, now=None):
+        """Remember one limiter decision"""
+        now = time.time() if now is None else now
+        rejected = 0 if decision.allowed else 1
+
+        self.publisher.ensure_started()
+        with self._lock:
+            totals = self._groups.get(group)
+            if totals is None:
+                totals = self._groups[group] = [0, 0]
+            totals[0] += 1
+            totals[1] += rejected
+
+            entry = self._keys.get((group, key))
+            if entry is None:
+                entry = self._keys[(group, key)] = [0, 0, 0.0, 0, 0, None, now]
+                if len(self._keys) > self.max_keys:
+                    self._keys.popitem(last=False)
+            else:
+                self._keys.move_to_end((group, key))
+            entry[0] = decision.limit - decision.remaining
+            entry[1] = decision.limit
+            entry[2] = now + decision.reset_after
+            entry[3] += 1
+            entry[4] += rejected
+            if rejected:
+                entry[5] = now
+            entry[6] = now
+
+    def snapshot(self):
+        """{'groups': {group: {...}}, 'keys': {group: [entry, ...]}} with the top keys per group"""
+        with self._lock:
+            groups = {group: list(totals) for group, totals in self._groups.items()}
+            entries = [(group, key, list(entry)) for (group, key), entry in self._keys.items()]
+
+        by_group = {}
+        for group, key, (used, limit, reset_at, requests, rejected, last_limited_at, last_seen) in entries:
+            by_group.setdefault(group, []).append({
+                'key': key,
+                'used': used,
+                'limit': limit,
+                'reset_at': reset_at,
+                'requests': requests,
+                'rejected': rejected,
+                'last_limited_at': last_limited_at,
+                'last_seen': last_seen,
+            })
+        return {
+            'groups': {group: {'requests': requests, 'rejected': rejected} for group, (requests, rejected) in groups.items()},
+            'keys': {group: top_keys(keys, self.top_keys) for group, keys in by_group.items()},
+        }
+
+    def publish(self):
+        self.publisher.publish()
+
+    def _reset(self):
+        # Counts copied from the parent belong to the parent
+        with self._lock:
+            self._groups.clear()
+            self._keys.clear()
+
+
+def top_keys(keys, count):
+    """The most throttled keys first: most rejections, then closest to the limit"""
+    return sorted(
+        keys,
+        key=lambda entry: (entry['rejected'], entry['used'] / entry['limit'] if entry['limit'] else 0),
+        reverse=True
+    )[:count]
+
+
+def collect_rate_limit_index(top=None):
+    """
+    Merge every live worker's published snapshot. Totals are summed; a key
+    seen by several workers sums its requests and rejections and keeps the
+    latest usage.
+    """
+    groups = {}
+    entries = {}
+    for snapshot in rate_limit_index.publisher.collect():
+        for group, totals in snapshot['groups'].items():
+            merged = groups.setdefault(group, {'requests': 0, 'rejected': 0})
+            merged['requests'] += totals['requests']
+            merged['rejected'] += totals['rejected']
+        for group, group_entries in snapshot['keys'].items():
+            for entry in group_entries:
+                merged = entries.get((group, entry['key']))
+                if merged is None:
+                    entries[(group, entry['key'])] = dict(entry)
+                    continue
+                merged['requests'] += entry['requests']
+                merged['rejected'] += entry['rejected']
+                if entry['last_seen'] > merged['last_seen']:
+                    merged.update(used=entry['used'], limit=entry['limit'],
+                                  reset_at=entry['reset_at'], last_seen=entry['last_seen'])
+                if entry['last_limited_at'] and (merged['last_limited_at'] or 0) < entry['last_limited_at']:
+                    merged['last_limited_at'] = entry['last_limited_at']
+
+    by_group = {}
+    for (group, _), entry in entries.items():
+        by_group.setdefault(group, []).append(entry)
+    if top is None:
+        top = rate_limit_index.top_keys
+    return {
+        'groups': groups,
+        'keys': {group: top_keys(group_entries, top) for group, group_entries in by_group.items()},
+    }
+
+
+_config = get_index_settings()
+
+# Fed by every rate-limited view in this process
+rate_limit_index = RateLimitIndex(
+    max_keys=_config['INDEX_MAX_KEYS'],
+    top_keys=_config['INDEX_TOP_KEYS'],
+    publish_interval=_config['INDEX_PUBLISH_INTERVAL'],
+)
@@ -0,0 +1,116 @@
+import collections
+
+from django.db import transaction
+from django.db.models import Count, F, Max
+from django.utils import timezone
+
+from .models import RequestLog, RequestLogCounter
+from .rollups import request_counts_by_country, request_totals
+
+
+def counter_deltas(entries, include_total=True):
+    """Counter increments for RequestLog rows: {(kind, country, city): n}"""
+    deltas = collections.Counter()
+    for entry in entries:
+        if include_total:
+            deltas[('total', '', '')] += 1
+        if entry.country:
+            deltas[('country', entry.country, '')] += 1
+            if entry.city:
+                deltas[('city', entry.country, entry.city)] += 1
+    return deltas
+
+
+def increment_counters(deltas):
+    """
+    Apply increments with one UPDATE per counter; missing counters are created
+    first. Everything is one transaction, so SQLite commits once, not per counter.
+    """
+    if not deltas:
+        return
+
+    now = timezone.now()
+    with transaction.atomic():
+        RequestLogCounter.objects.bulk_create(
+            [RequestLogCounter(kind=kind, country=country, city=city) for kind, country, city in deltas],
+            ignore_conflicts=True
+        )
+        for (kind, country, city), amount in deltas.items():
+            RequestLogCounter.objects.filter(kind=kind, country=country, city=city).update(
+                count=F('count') + amount,
+                updated_at=now
+            )
+
+
+def get_total_requests():
+    """(total request count, time it was last updated)"""
+    total = (
+        RequestLogCounter.objects
+        .filter(kind='total', country='', city='')
+        .values_list('count', 'updated_at')
+        .first()
+    )
+    return total or (0, None)
+
+
+def get_geolocation_stats(top_countries=10):
+    """Request statistics read from the counters, independent of RequestLog size"""
+    countries = RequestLogCounter.objects.filter(kind='country')
+    cities = RequestLogCounter.objects.filter(kind='city')
+    return {
+        'total_requests': get_total_requests()[0],
+        'countries': countries.count(),
+        'cities': list(cities.order_by('country', 'city').values('city', 'country')),
+        'requests_by_country': list(countries.order_by('-count').values('country', 'count')[:top_countries]),
+        'updated_at': RequestLogCounter.objects.aggregate(updated_at=Max('updated_at'))['updated_at'],
+    }
+
+
+def get_window_stats(since, top_countries=10):
+    """
+    Request statistics since `since`, read from the hourly rollups plus the
+    raw rows of hours not rolled up yet, so pruned history still counts.
+    Rolled-up hours are counted whole.
+    """
+    totals = request_totals(since)
+    by_country = sorted(request_counts_by_country(since).items(), key=lambda item: -item[1]['requests'])
+    return {
+        'since': since,
+        'total_requests': totals['requests'],
+        'sensitive_requests': totals['sensitive'],
+        'countries': len(by_country),
+        'requests_by_country': [
+            {'country': country, 'count': counts['requests']}
+            for country, counts in by_country[:top_countries]
+        ],
+    }
+
+
+def rebuild_counters():
+    """
+    Recompute every counter. Total and country counts come from the hourly
+    rollups plus the raw rows not rolled up yet, so rows already pruned are
+    still counted. Rollups carry no city, so city counts only cover the raw
+    rows still stored.
+    """
+    deltas = collections.Counter()
+    deltas[('total', '', '')] = request_totals()['requests']
+    for country, counts in request_counts_by_country().items():
+        deltas[('country', country, '')] += counts['requests']
+
+    for row in (
+        RequestLog.objects
+        .exclude(country__isnull=True)
+        .exclude(country='')
+        .exclude(city__isnull=True)
+        .exclude(city='')
+        .order_by()
+        .values('country', 'city')
+        .annotate(count=Count('id'))
+    ):
+        deltas[('city', row['country'], row['city'])] += row['count']
+
+    with transaction.atomic():
+        RequestLogCounter.objects.all().delete()
+        increment_counters(deltas)
+    return len(deltas)
@@ -0,0 +1,274 @@
+"""
+Hourly rollups of RequestLog and retention of raw rows.
+
+Complete hours are folded into per-(ip, hour) totals, which cover every
+request, and per-(country, hour) totals, which cover located requests only. Raw rows older than the retention period are then deleted in small
+batches, and only once their hour has been rolled up. Reads over long
+windows combine the rollups with the raw rows of hours not rolled up yet.
+
+An hour whose rows still wait for geolocation is rolled up once enrichment
+has caught up, or after ENRICHMENT_WAIT_MINUTES. Rows located or imported
+after their hour was rolled up are added to the rollups with
+add_to_rollups() instead of recomputing the hour, whose raw rows may
+already be pruned.
+"""
+import time
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Sum
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from .models import RequestLog, RequestLogHourlyCountry, RequestLogHourlyIP
+
+ONE_HOUR = timedelta(hours=1)
+
+
+def get_retention_settings():
+    """REQUEST_LOG_RETENTION settings with defaults applied"""
+    config = {
+        'RAW_DAYS': 30,
+        'ROLLUP_DAYS': 365,
+        'ROLLUP_GRACE_MINUTES': 10,
+        'ENRICHMENT_WAIT_MINUTES': 60,
+        'MAX_HOURS_PER_RUN': 48,
+        'DELETE_BATCH_SIZE': 2000,
+        'MAX_DELETE_BATCHES': 500,
+        'DELETE_PAUSE': 0.05,
+    }
+    config.update(getattr(settings, 'REQUEST_LOG_RETENTION', {}))
+    return config
+
+
+def floor_hour(value):
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def rolled_up_until():
+    """Start of the first hour that has not been rolled up, or None if nothing has"""
+    latest = RequestLogHourlyIP.objects.aggregate(latest=Max('hour'))['latest']
+    return latest + ONE_HOUR if latest else None
+
+
+def rollup_hour(hour):
+    """(Re)compute the rollups of one hour; returns the number of raw rows folded"""
+    rows = RequestLog.objects.filter(timestamp__gte=hour, timestamp__lt=hour + ONE_HOUR).order_by()
+    counts = {
+        'request_count': Count('id'),
+        'sensitive_count': Count('id', filter=Q(is_sensitive=True)),
+    }
+
+    by_ip = [
+        RequestLogHourlyIP(hour=hour, **row)
+        for row in rows.values('ip_address').annotate(**counts)
+    ]
+    # Unlocated traffic is only in the per-IP rollup; there is no '' country
+    by_country = [
+        RequestLogHourlyCountry(hour=hour, **row)
+        for row in located(rows).values('country').annotate(**counts)
+    ]
+
+    with transaction.atomic():
+        RequestLogHourlyIP.objects.filter(hour=hour).delete()
+        RequestLogHourlyCountry.objects.filter(hour=hour).delete()
+        RequestLogHourlyIP.objects.bulk_create(by_ip, batch_size=1000)
+        RequestLogHourlyCountry.objects.bulk_create(by_country, batch_size=1000)
+
+    return sum(row.request_count for row in by_ip)
+
+
+def rollup_request_logs(start=None, end=None):
+    """
+    Roll up complete hours in [start, end). By default this continues after the
+    last rolled-up hour and stops ROLLUP_GRACE_MINUTES before the current hour
+    ends, so buffered log writes have landed. Hours without traffic are skipped.
+    An hour with rows still waiting for geolocation stops the run, unless it
+    ended more than ENRICHMENT_WAIT_MINUTES ago.
+    """
+    config = get_retention_settings()
+    now = timezone.now()
+    if end is None:
+        end = floor_hour(now - timedelta(minutes=config['ROLLUP_GRACE_MINUTES']))
+    enrichment_deadline = now - timedelta(minutes=config['ENRICHMENT_WAIT_MINUTES'])
+    if start is None:
+        start = rolled_up_until()
+
+    hours = 0
+    rows = 0
+    hour = floor_hour(start) if start else None
+    while hours < config['MAX_HOURS_PER_RUN']:
+        # Jump to the next hour that has traffic
+        next_timestamp = (
+            RequestLog.objects
+            .filter(**({'timestamp__gte': hour} if hour else {}))
+            .order_by('timestamp')
+            .values_list('timestamp', flat=True)
+            .first()
+        )
+        if next_timestamp is None:
+            break
+        hour = floor_hour(next_timestamp)
+        if hour >= end:
+            break
+        if hour + ONE_HOUR > enrichment_deadline and RequestLog.objects.filter(
+            timestamp__gte=hour, timestamp__lt=hour + ONE_HOUR, geolocation_data__isnull=True
+        ).exists():
+            break
+
+        rows += rollup_hour(hour)
+        hours += 1
+        hour += ONE_HOUR
+
+    return {'hours_rolled_up': hours, 'rows_rolled_up': rows}
+
+
+def hourly_counts(rows, key):
+    """{(hour, key value): (requests, sensitive)} for raw rows, by UTC hour"""
+    return {
+        (row['hour'], row[key]): (row['requests'], row['sensitive'])
+        for row in (
+            rows
+            .order_by()
+            .annotate(hour=TruncHour('timestamp', tzinfo=dt_timezone.utc))
+            .values('hour', key)
+            .annotate(requests=Count('id'), sensitive=Count('id', filter=Q(is_sensitive=True)))
+        )
+    }
+
+
+def add_to_rollups(rollup_model, key, counts):
+    """
+    Add {(hour, key value): (requests, sensitive)} to rolled-up hours with F()
+    increments; missing rollup rows are created first.
+    """
+    if not counts:
+        return
+
+    with transaction.atomic():
+        rollup_model.objects.bulk_create(
+            [rollup_model(hour=hour, **{key: value}) for hour, value in counts],
+            ignore_conflicts=True
+        )
+        for (hour, value), (requests, sensitive) in counts.items():
+            rollup_model.objects.filter(hour=hour, **{key: value}).update(
+                request_count=F('request_count') + requests,
+                sensitive_count=F('sensitive_count') + sensitive
+            )
+
+
+def prune_request_logs():
+    """
+    Delete raw rows older than RAW_DAYS in small batches, each in its own short
+    transaction, so writers are never locked out for long. Rows in hours that
+    have not been rolled up are kept. Rollups older than ROLLUP_DAYS go too.
+    """
+    config = get_retention_settings()
+    now = timezone.now()
+
+    deleted = 0
+    rolled_until = rolled_up_until()
+    if rolled_until is not None:
+        cutoff = min(now - timedelta(days=config['RAW_DAYS']), rolled_until)
+        for _ in range(config['MAX_DELETE_BATCHES']):
+            ids = list(
+                RequestLog.objects
+                .filter(timestamp__lt=cutoff)
+                .order_by('timestamp')
+                .values_list('id', flat=True)[:config['DELETE_BATCH_SIZE']]
+            )
+            if not ids:
+                break
+            deleted += RequestLog.objects.filter(id__in=ids).delete()[0]
+            time.sleep(config['DELETE_PAUSE'])
+
+    rollup_cutoff = now - timedelta(days=config['ROLLUP_DAYS'])
+    deleted_rollups = RequestLogHourlyIP.objects.filter(hour__lt=rollup_cutoff).delete()[0]
+    deleted_rollups += RequestLogHourlyCountry.objects.filter(hour__lt=rollup_cutoff).delete()[0]
+
+    return {'deleted_rows': deleted, 'deleted_rollups': deleted_rollups}
+
+
+def located(rows):
+    return rows.exclude(country__isnull=True).exclude(country='')
+
+
+def _combined_counts(rollup_model, key, since=None, raw_filter=lambda rows: rows):
+    """Rollups for whole hours since `since` (all of them if None), plus raw rows not rolled up yet"""
+    totals = {}
+
+    def add(row_key, requests, sensitive):
+        total = totals.setdefault(row_key, {'requests': 0, 'sensitive': 0})
+        total['requests'] += requests
+        total['sensitive'] += sensitive
+
+    rolled_until = rolled_up_until()
+    if rolled_until is not None:
+        rollups = rollup_model.objects.filter(hour__lt=rolled_until)
+        if since is not None:
+            rollups = rollups.filter(hour__gte=floor_hour(since))
+        for row in (
+            rollups
+            .values(key)
+            .annotate(requests=Sum('request_count'), sensitive=Sum('sensitive_count'))
+            .order_by()
+        ):
+            add(row[key], row['requests'], row['sensitive'])
+
+    raw_since = since
+    if rolled_until is not None and (since is None or since < rolled_until):
+        raw_since = rolled_until
+    raw_rows = raw_filter(RequestLog.objects.all())
+    if raw_since is not None:
+        raw_rows = raw_rows.filter(timestamp__gte=raw_since)
+    for row in (
+        raw_rows
+        .order_by()
+        .values(key)
+        .annotate(requests=Count('id'), sensitive=Count('id', filter=Q(is_sensitive=True)))
+    ):
+        add(row[key], row['requests'], row['sensitive'])
+
+    return totals
+
+
+def request_counts_by_ip(since=None):
+    """{ip: {'requests': n, 'sensitive': n}} since `since`, at hour granularity for rolled-up hours"""
+    return _combined_counts(RequestLogHourlyIP, 'ip_address', since)
+
+
+def request_counts_by_country(since=None):
+    """{country: {'requests': n, 'sensitive': n}} since `since`, located requests only"""
+    return _combined_counts(RequestLogHourlyCountry, 'country', since, raw_filter=located)
+
+
+def rolled_up_counts_by_ip(hours, now=None):
+    """
+    {ip: {'requests': n, 'sensitive': n}} over the rolled-up hours among the
+    last `hours`. Reads the per-IP rollups only, never raw rows.
+    """
+    rolled_until = rolled_up_until()
+    if rolled_until is None:
+        return {}
+    now = timezone.now() if now is None else now
+    rows = (
+        RequestLogHourlyIP.objects
+        .filter(hour__gte=floor_hour(now) - hours * ONE_HOUR, hour__lt=rolled_until)
+        .values('ip_address')
+        .annotate(requests=Sum('request_count'), sensitive=Sum('sensitive_count'))
+        .order_by()
+    )
+    return {
+        row['ip_address']: {'requests': row['requests'], 'sensitive': row['sensitive']}
+        for row in rows
+    }
+
+
+def request_totals(since=None):
+    """{'requests': n, 'sensitive': n} since `since`, located or not"""
+    totals = {'requests': 0, 'sensitive': 0}
+    for counts in request_counts_by_ip(since).values():
+        totals['requests'] += counts['requests']
+        totals['sensitive'] += counts['sensitive']
+    return totals
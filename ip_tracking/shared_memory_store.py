@@ -0,0 +1,241 @@
+"""
+Rate-limit counters shared by every worker process on a host.
+
+The counters live in a fixed-size hash table in a memory-mapped file,
+normally under /dev/shm. Each slot holds one limiter key's sliding-window
+counts, or its token-bucket arrival time:
+
+    key hash (u64) | window (i64) | current (u64) | previous (u64) | expires_at (f64)
+
+A key hashes to an aligned bucket of PROBE_LENGTH slots. Each bucket is
+guarded by one of a fixed number of stripes. A stripe is a thread lock
+for the threads of this process plus an fcntl byte-range lock for the
+other processes. Each stripe also owns a pair of table-wide counters
+(expired slots reused, keys turned away), updated under its lock.
+
+The footprint never grows. A new key takes an empty or expired slot in its
+bucket; live slots are never taken over, since that would reset another
+key's count. When the bucket has neither, StoreFull is raised and the
+limiter applies RATE_LIMITS['WHEN_STORE_FULL'].
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+MAGIC = b'IPRLSHM2'
+HEADER = struct.Struct('<8sIII')      # magic, slot count, probe length, stripe count
+STRIPE_STATS = struct.Struct('<QQ')   # expired slots reused, keys turned away
+SLOT = struct.Struct('<QqQQd')        # key hash, window, current, previous, expires_at
+PROBE_LENGTH = 8
+
+# fcntl locks are advisory and may cover bytes past the end of the file,
+# so the stripes lock offsets that hold no data
+INIT_LOCK_OFFSET = 1 << 40
+STRIPE_LOCK_OFFSET = INIT_LOCK_OFFSET + 1
+
+
+class StoreFull(Exception):
+    """Every slot in the key's bucket holds another live key"""
+
+
+def default_path(namespace=''):
+    """Table path for a deployment; namespace keeps deployments on one host apart"""
+    directory = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    name = f'ip_tracking_rate_limits_{namespace}' if namespace else 'ip_tracking_rate_limits'
+    return os.path.join(directory, name)
+
+
+class SharedMemoryStore:
+    """
+    Host-wide rate-limit store over a shared mmap; the protocol matches
+    LocalStore and RedisStore (incr_window and gcra). Every worker that
+    opens the same path with the same slot count shares the counters.
+    """
+
+    def __init__(self, path=None, slots=65536, stripes=64):
+        self.path = path or default_path()
+        self.probe_length = PROBE_LENGTH
+        self.buckets = max(1, slots // PROBE_LENGTH)
+        self.slots = self.buckets * PROBE_LENGTH
+        self.stripes = stripes
+        self.slots_offset = HEADER.size + stripes * STRIPE_STATS.size
+        self.size = self.slots_offset + self.slots * SLOT.size
+
+        self._fd = None
+        self._map = None
+        self._pid = None
+        self._thread_locks = []
+
+    def _ensure_open(self):
+        if self._pid == os.getpid():
+            return
+        # Thread locks held in the parent at fork time would never be released here
+        self._thread_locks = [threading.Lock() for _ in range(self.stripes)]
+        if self._map is None:
+            self._open()
+        self._pid = os.getpid()
+
+    def _open(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, INIT_LOCK_OFFSET)
+        try:
+            header = os.pread(fd, HEADER.size, 0)
+            expected = HEADER.pack(MAGIC, self.slots, self.probe_length, self.stripes)
+            if not header.startswith(MAGIC):
+                # New or foreign file: nothing else can have it mapped as a table yet
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, self.size)
+                os.pwrite(fd, expected, 0)
+            elif header != expected or os.fstat(fd).st_size != self.size:
+                # Resizing would pull the table out from under the workers using it
+                raise ValueError(
+                    f"{self.path} holds a table of another size; remove it or configure another path"
+                )
+        except BaseException:
+            # Closing the descriptor also drops its lock
+            os.close(fd)
+            raise
+        fcntl.lockf(fd, fcntl.LOCK_UN, 1, INIT_LOCK_OFFSET)
+        self._fd = fd
+        self._map = mmap.mmap(fd, self.size, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+            self._fd = None
+            self._pid = None
+
+    def key_hash(self, key):
+        # Zero marks an empty slot
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') or 1
+
+    def _locked(self, bucket):
+        stripe = bucket % self.stripes
+        return _StripeLock(self._thread_locks[stripe], self._fd, STRIPE_LOCK_OFFSET + stripe)
+
+    def _count(self, bucket, field):
+        """Bump one of the stripe's table-wide counters; the stripe lock is held"""
+        offset = HEADER.size + (bucket % self.stripes) * STRIPE_STATS.size
+        counts = list(STRIPE_STATS.unpack_from(self._map, offset))
+        counts[field] += 1
+        STRIPE_STATS.pack_into(self._map, offset, *counts)
+
+    def _find_slot(self, key_hash, bucket, now):
+        """
+        Offset of key_hash's slot in bucket, and whether it already holds it.
+        Otherwise an empty slot, or else the expired slot that expired first.
+        Raises StoreFull when every slot holds a live key.
+        """
+        first = self.slots_offset + bucket * self.probe_length * SLOT.size
+        free = None
+        expired = None
+        expired_at = None
+        for index in range(self.probe_length):
+            offset = first + index * SLOT.size
+            slot_hash, _, _, _, expires_at = SLOT.unpack_from(self._map, offset)
+            if slot_hash == key_hash:
+                return offset, True
+            if slot_hash == 0:
+                if free is None:
+                    free = offset
+            elif expires_at <= now and (expired is None or expires_at < expired_at):
+                expired, expired_at = offset, expires_at
+        if free is not None:
+            return free, False
+        if expired is not None:
+            self._count(bucket, 0)
+            return expired, False
+        self._count(bucket, 1)
+        raise StoreFull(f'No free slot for a new key in {self.path}')
+
+    def incr_window(self, key, window, period, amount=1):
+        """Add to the count of window; returns (current window count, previous window count)"""
+        self._ensure_open()
+        now = time.time()
+        key_hash = self.key_hash(key)
+        bucket = key_hash % self.buckets
+        with self._locked(bucket):
+            offset, found = self._find_slot(key_hash, bucket, now)
+            current, previous = 0, 0
+            if found:
+                _, slot_window, slot_current, slot_previous, _ = SLOT.unpack_from(self._map, offset)
+                if slot_window == window:
+                    current, previous = slot_current, slot_previous
+                elif slot_window == window - 1:
+                    previous = slot_current
+            current += amount
+            SLOT.pack_into(self._map, offset, key_hash, window, current, previous, (window + 2) * period)
+        return current, previous
+
+    def gcra(self, key, now, interval, tolerance):
+        """Generic cell rate algorithm step; returns (allowed, theoretical arrival time)"""
+        self._ensure_open()
+        key_hash = self.key_hash(key)
+        bucket = key_hash % self.buckets
+        with self._locked(bucket):
+            offset, found = self._find_slot(key_hash, bucket, now)
+            tat = now
+            if found:
+                tat = max(SLOT.unpack_from(self._map, offset)[4], now)
+            new_tat = tat + interval
+            if new_tat - now > tolerance:
+                return False, tat
+            SLOT.pack_into(self._map, offset, key_hash, 0, 0, 0, new_tat)
+        return True, new_tat
+
+    def stats(self):
+        """Slot usage and counters for the whole table, from every process; read without locking"""
+        self._ensure_open()
+        now = time.time()
+        used = live = 0
+        for index in range(self.slots):
+            slot_hash, _, _, _, expires_at = SLOT.unpack_from(self._map, self.slots_offset + index * SLOT.size)
+            if slot_hash:
+                used += 1
+                live += expires_at > now
+        reused = full = 0
+        for stripe in range(self.stripes):
+            stripe_reused, stripe_full = STRIPE_STATS.unpack_from(self._map, HEADER.size + stripe * STRIPE_STATS.size)
+            reused += stripe_reused
+            full += stripe_full
+        return {
+            'path': self.path,
+            'slots': self.slots,
+            'size_bytes': self.size,
+            'used_slots': used,
+            'live_slots': live,
+            'expired_slots_reused': reused,
+            'keys_turned_away': full,
+        }
+
+
+class _StripeLock:
+    """This process's thread lock for a stripe, then the stripe's cross-process fcntl lock"""
+
+    __slots__ = ('thread_lock', 'fd', 'offset')
+
+    def __init__(self, thread_lock, fd, offset):
+        self.thread_lock = thread_lock
+        self.fd = fd
+        self.offset = offset
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, self.offset)
+        except BaseException:
+            self.thread_lock.release()
+            raise
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, self.offset)
+        finally:
+            self.thread_lock.release()
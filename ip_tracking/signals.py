@@ -0,0 +1,20 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .blocklist import bump_blocklist_version
+from .models import BlockedIP, SuspiciousIP
+from .suspicious import bump_suspicious_version
+
+
+@receiver(post_save, sender=BlockedIP)
+@receiver(post_delete, sender=BlockedIP)
+def blocked_ip_changed(sender, **kwargs):
+    """Invalidate blocklist indexes in every process"""
+    bump_blocklist_version()
+
+
+@receiver(post_save, sender=SuspiciousIP)
+@receiver(post_delete, sender=SuspiciousIP)
+def suspicious_ip_changed(sender, **kwargs):
+    """Invalidate cached suspicious IP responses in every process"""
+    bump_suspicious_version()
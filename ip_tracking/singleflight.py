@@ -0,0 +1,201 @@
+import collections
+import os
+import threading
+import time
+
+from django.core.cache import cache
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls for the same key into a single execution.
+
+    Within a process, the first caller runs the function and the others wait
+    for its result. Across processes, the leader also takes a short-lived lock
+    key in the shared cache; leaders in other processes that find the lock
+    taken poll ``read_shared`` for the value the owner stores, instead of
+    repeating the work. If nothing shows up before the wait timeout, the
+    caller runs the function itself, so a lost lock only costs a duplicate call.
+
+    do_many() does the same per key for batch functions: the batch runs once
+    for the keys nobody else is resolving, and waits for the rest.
+    """
+
+    def __init__(self, name, lock_timeout=15, wait_timeout=10, poll_interval=0.1):
+        self.name = name
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    def lock_key(self, key):
+        return f"{self.name}_lock_{key}"
+
+    def stats(self):
+        """Counters: executed, coalesced_local, coalesced_remote, wait_timeouts"""
+        with self._lock:
+            return {
+                'executed': self._stats['executed'],
+                'coalesced_local': self._stats['coalesced_local'],
+                'coalesced_remote': self._stats['coalesced_remote'],
+                'wait_timeouts': self._stats['wait_timeouts'],
+            }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def do(self, key, fn, read_shared=None):
+        """Return fn(), sharing one execution among concurrent callers for key"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if call.event.wait(self.wait_timeout) and call.result is not None:
+                self._count('coalesced_local')
+                return call.result
+            self._count('wait_timeouts')
+            self._count('executed')
+            return fn()
+
+        try:
+            call.result = self._lead(key, fn, read_shared)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+    def do_many(self, keys, fn, read_shared=None):
+        """
+        Return {key: result} for keys, where fn(keys) -> {key: result} runs once
+        for the keys no concurrent caller is already resolving and
+        read_shared(keys) -> {key: value} reads what other processes stored.
+        """
+        results = {}
+        leading = {}
+        waiting = {}
+        with self._lock:
+            for key in dict.fromkeys(keys):
+                call = self._calls.get(key)
+                if call is None:
+                    leading[key] = self._calls[key] = _Call()
+                else:
+                    waiting[key] = call
+
+        try:
+            if leading:
+                results.update(self._lead_many(list(leading), fn, read_shared))
+        finally:
+            with self._lock:
+                for key in leading:
+                    del self._calls[key]
+            for key, call in leading.items():
+                call.result = results.get(key)
+                call.event.set()
+
+        deadline = time.monotonic() + self.wait_timeout
+        timed_out = []
+        for key, call in waiting.items():
+            if call.event.wait(max(0, deadline - time.monotonic())) and call.result is not None:
+                self._count('coalesced_local')
+                results[key] = call.result
+            else:
+                timed_out.append(key)
+        if timed_out:
+            self._count('wait_timeouts', len(timed_out))
+            self._count('executed', len(timed_out))
+            results.update(fn(timed_out))
+        return results
+
+    def _lead_many(self, keys, fn, read_shared):
+        if read_shared is None:
+            self._count('executed', len(keys))
+            return fn(keys)
+
+        owned = [key for key in keys if cache.add(self.lock_key(key), os.getpid(), self.lock_timeout)]
+        results = {}
+        if owned:
+            try:
+                self._count('executed', len(owned))
+                results.update(fn(owned))
+            finally:
+                cache.delete_many([self.lock_key(key) for key in owned])
+
+        # Other processes are already looking the rest up
+        owned = set(owned)
+        pending = [key for key in keys if key not in owned]
+        abandoned = []
+        deadline = time.monotonic() + self.wait_timeout
+        while pending:
+            found = {key: value for key, value in read_shared(pending).items() if value is not None}
+            self._count('coalesced_remote', len(found))
+            results.update(found)
+            pending = [key for key in pending if key not in found]
+            if not pending:
+                break
+            # Owners that released their lock without storing a value gave up
+            locks = cache.get_many([self.lock_key(key) for key in pending])
+            abandoned += [key for key in pending if self.lock_key(key) not in locks]
+            pending = [key for key in pending if self.lock_key(key) in locks]
+            if pending and time.monotonic() >= deadline:
+                self._count('wait_timeouts', len(pending))
+                break
+            if pending:
+                time.sleep(self.poll_interval)
+
+        retry = abandoned + pending
+        if abandoned:
+            # The owner may have stored its value just before releasing the lock
+            found = {key: value for key, value in read_shared(retry).items() if value is not None}
+            self._count('coalesced_remote', len(found))
+            results.update(found)
+            retry = [key for key in retry if key not in found]
+        if retry:
+            self._count('executed', len(retry))
+            results.update(fn(retry))
+        return results
+
+    def _lead(self, key, fn, read_shared):
+        if read_shared is None:
+            self._count('executed')
+            return fn()
+
+        lock_key = self.lock_key(key)
+        if cache.add(lock_key, os.getpid(), self.lock_timeout):
+            try:
+                self._count('executed')
+                return fn()
+            finally:
+                cache.delete(lock_key)
+
+        # Another process is already looking this key up
+        deadline = time.monotonic() + self.wait_timeout
+        while time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = read_shared()
+            if value is not None:
+                self._count('coalesced_remote')
+                return value
+            if cache.get(lock_key) is None:
+                break
+        else:
+            self._count('wait_timeouts')
+
+        value = read_shared()
+        if value is not None:
+            self._count('coalesced_remote')
+            return value
+        self._count('executed')
+        return fn()
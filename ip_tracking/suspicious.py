@@ -0,0 +1,28 @@
+import time
+import uuid
+
+from django.core.cache import cache
+
+from .deferred import deferrable
+
+SUSPICIOUS_VERSION_KEY = 'ip_suspicious_version'
+
+
+def get_suspicious_version():
+    """
+    (token, changed_at) for the current state of the SuspiciousIP table.
+    The token changes on every write; changed_at is when it last did, in
+    epoch seconds. A lost cache entry starts a new version, which only
+    costs clients one full response.
+    """
+    version = cache.get(SUSPICIOUS_VERSION_KEY)
+    if version is None:
+        cache.add(SUSPICIOUS_VERSION_KEY, (uuid.uuid4().hex, time.time()), None)
+        version = cache.get(SUSPICIOUS_VERSION_KEY)
+    return version
+
+
+@deferrable
+def bump_suspicious_version():
+    """Tell every process that SuspiciousIP rows changed, so cached responses are stale"""
+    cache.set(SUSPICIOUS_VERSION_KEY, (uuid.uuid4().hex, time.time()), None)
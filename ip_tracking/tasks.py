@@ -0,0 +1,428 @@
+from celery import shared_task
+from django.utils import timezone
+from django.db import transaction
+from django.db.models import Count
+from collections import Counter
+from datetime import timedelta
+from .models import BlockedIP, RequestLog, RequestLogHourlyCountry, SuspiciousIP
+from .geolocation import GeolocationService
+from . import rollups
+from .request_counters import increment_counters, rebuild_counters
+from .suspicious import bump_suspicious_version
+from .window_counters import collect_window_counters, get_window_settings
+from django.conf import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+@shared_task
+def detect_suspicious_ips():
+    """
+    Celery task to detect suspicious IPs based on:
+    - High request volume (>100 requests per hour)
+    - Access to sensitive paths
+    - Multiple sensitive path accesses
+    """
+    logger.info("Starting suspicious IP detection task")
+    
+    one_hour_ago = timezone.now() - timedelta(hours=1)
+    results = {
+        'high_volume_ips': [],
+        'sensitive_access_ips': [],
+        'total_detected': 0
+    }
+    
+    try:
+        # Read the sliding windows kept at ingest instead of scanning the log table
+        window = collect_window_counters() if get_window_settings()['WINDOW_COUNTERS'] else None
+        
+        # 1. Detect IPs with high request volume; sustained volume is checked by the rollup task
+        high_volume_ips = detect_high_volume_ips(one_hour_ago, window)
+        
+        # 2. Detect IPs accessing sensitive paths
+        sensitive_ips = detect_sensitive_path_access(one_hour_ago, window)
+        
+        # 3. Create SuspiciousIP records for new findings
+        high_volume_ips, sensitive_ips = save_suspicious_ips(high_volume_ips, sensitive_ips)
+        results['high_volume_ips'] = high_volume_ips
+        results['sensitive_access_ips'] = sensitive_ips
+        
+        all_suspicious_ips = combine_suspicious_ips(high_volume_ips, sensitive_ips)
+        results['total_detected'] = len(all_suspicious_ips)
+        
+        logger.info(f"Anomaly detection completed. Found {len(all_suspicious_ips)} suspicious IPs")
+        
+        return results
+        
+    except Exception as e:
+        logger.error(f"Error in anomaly detection task: {e}")
+        return {'error': str(e)}
+
+def detect_high_volume_ips(since_time, window=None):
+    """Find IPs with request volume exceeding threshold"""
+    threshold = settings.ANOMALY_DETECTION['REQUESTS_PER_HOUR_THRESHOLD']
+    
+    if window is not None:
+        high_volume_ips = sorted(
+            (
+                {'ip_address': ip_address, 'request_count': counts['requests']}
+                for ip_address, counts in window.items()
+                if counts['requests'] > threshold
+            ),
+            key=lambda ip_data: -ip_data['request_count']
+        )
+    else:
+        high_volume_ips = (
+            RequestLog.objects
+            .filter(timestamp__gte=since_time)
+            .values('ip_address')
+            .annotate(request_count=Count('id'))
+            .filter(request_count__gt=threshold)
+            .order_by('-request_count')
+        )
+    
+    return [
+        {
+            'ip_address': ip_data['ip_address'],
+            'request_count': ip_data['request_count'],
+            'reason': 'high_volume',
+            'description': f"High request volume: {ip_data['request_count']} requests in the last hour (threshold: {threshold})"
+        }
+        for ip_data in high_volume_ips
+    ]
+
+def detect_sustained_volume_ips():
+    """
+    Find IPs whose volume over LONG_WINDOW_HOURS exceeds REQUESTS_PER_LONG_WINDOW_THRESHOLD.
+    Counts come from the rolled-up hours only, so the check reads no raw rows
+    and can only change when an hour is rolled up; rollup_request_logs runs it.
+    """
+    config = settings.ANOMALY_DETECTION
+    threshold = config.get('REQUESTS_PER_LONG_WINDOW_THRESHOLD')
+    if not threshold:
+        return []
+    hours = config.get('LONG_WINDOW_HOURS', 24)
+    
+    counts = rollups.rolled_up_counts_by_ip(hours)
+    return [
+        {
+            'ip_address': ip_address,
+            'request_count': ip_counts['requests'],
+            'reason': 'high_volume',
+            'description': f"Sustained request volume: {ip_counts['requests']} requests in the last {hours} hours (threshold: {threshold})"
+        }
+        for ip_address, ip_counts in sorted(counts.items(), key=lambda item: -item[1]['requests'])
+        if ip_counts['requests'] > threshold
+    ]
+
+def detect_sensitive_path_access(since_time, window=None):
+    """Find IPs accessing sensitive paths"""
+    if window is not None:
+        sensitive_access = [
+            {'ip_address': ip_address, 'path': path, 'access_count': access_count}
+            for ip_address, counts in window.items()
+            for path, access_count in counts['paths'].items()
+        ]
+    else:
+        # Paths are classified at ingest, so this is a range scan on (is_sensitive, timestamp)
+        sensitive_access = (
+            RequestLog.objects
+            .filter(is_sensitive=True, timestamp__gte=since_time)
+            .values('ip_address', 'path')
+            .annotate(access_count=Count('id'))
+            .order_by('-access_count')
+        )
+    
+    detected_ips = []
+    ip_path_access = {}
+    
+    # Group by IP address to count total sensitive accesses
+    for access in sensitive_access:
+        ip_address = access['ip_address']
+        path = access['path']
+        access_count = access['access_count']
+        
+        if ip_address not in ip_path_access:
+            ip_path_access[ip_address] = {
+                'paths': {},
+                'total_accesses': 0
+            }
+        
+        ip_path_access[ip_address]['paths'][path] = access_count
+        ip_path_access[ip_address]['total_accesses'] += access_count
+    
+    for ip_address, data in ip_path_access.items():
+        total_accesses = data['total_accesses']
+        paths_accessed = list(data['paths'].keys())
+        
+        # Determine reason based on access pattern
+        if len(paths_accessed) > 1:
+            reason = 'multiple_sensitive'
+            description = f"Accessed multiple sensitive paths: {', '.join(paths_accessed)}. Total accesses: {total_accesses}"
+        else:
+            reason = 'sensitive_access'
+            description = f"Accessed sensitive path: {paths_accessed[0]}. Total accesses: {total_accesses}"
+        
+        detected_ips.append({
+            'ip_address': ip_address,
+            'paths_accessed': paths_accessed,
+            'total_accesses': total_accesses,
+            'reason': reason,
+            'description': description
+        })
+    
+    return detected_ips
+
+def save_suspicious_ips(high_volume_ips, sensitive_ips, batch_size=500):
+    """
+    Persist new findings with a fixed number of queries, however many IPs were flagged.
+    Open suspicions are loaded once; findings already covered by one only refresh
+    its request count, and the rest are created in bulk. Returns the newly created
+    (high_volume_ips, sensitive_ips), each entry with its suspicious_ip_id.
+    """
+    if not high_volume_ips and not sensitive_ips:
+        return [], []
+    
+    # An open suspicious_pattern record covers both kinds of finding
+    open_suspicions = {}
+    for suspicion in (
+        SuspiciousIP.objects
+        .filter(is_resolved=False)
+        .only('id', 'ip_address', 'reason', 'request_count')
+        .iterator(chunk_size=2000)
+    ):
+        open_suspicions[(suspicion.ip_address, suspicion.reason)] = suspicion
+    
+    def find_open(ip_address, reason):
+        return (
+            open_suspicions.get((ip_address, reason))
+            or open_suspicions.get((ip_address, 'suspicious_pattern'))
+        )
+    
+    new_high_volume = []
+    new_sensitive = []
+    refreshed = {}
+    for ip_data, new_list in [(d, new_high_volume) for d in high_volume_ips] + [(d, new_sensitive) for d in sensitive_ips]:
+        request_count = ip_data.get('request_count', ip_data.get('total_accesses', 0))
+        existing = find_open(ip_data['ip_address'], ip_data['reason'])
+        if existing is None:
+            new_list.append(ip_data)
+        elif request_count > existing.request_count:
+            existing.request_count = request_count
+            refreshed[existing.id] = existing
+    
+    # IP has both high volume and sensitive access - upgrade the high volume record
+    new_sensitive_by_ip = {ip_data['ip_address']: ip_data for ip_data in new_sensitive}
+    records = []
+    for ip_data in new_high_volume:
+        reason = 'high_volume'
+        description = ip_data['description']
+        sensitive_data = new_sensitive_by_ip.get(ip_data['ip_address'])
+        if sensitive_data:
+            reason = 'suspicious_pattern'
+            description += f" | Also: {sensitive_data['description']}"
+        records.append(SuspiciousIP(
+            ip_address=ip_data['ip_address'],
+            reason=reason,
+            description=description,
+            request_count=ip_data['request_count']
+        ))
+    for ip_data in new_sensitive:
+        records.append(SuspiciousIP(
+            ip_address=ip_data['ip_address'],
+            reason=ip_data['reason'],
+            description=ip_data['description'],
+            request_count=ip_data['total_accesses']
+        ))
+    
+    with transaction.atomic():
+        SuspiciousIP.objects.bulk_create(records, batch_size=batch_size)
+        SuspiciousIP.objects.bulk_update(list(refreshed.values()), ['request_count'], batch_size=batch_size)
+    if records or refreshed:
+        # Bulk writes send no post_save signals
+        bump_suspicious_version()
+    
+    for ip_data, record in zip(new_high_volume + new_sensitive, records):
+        ip_data['suspicious_ip_id'] = record.id
+        logger.warning(f"Detected suspicious IP: {ip_data['ip_address']} - {record.description}")
+    
+    return new_high_volume, new_sensitive
+
+def combine_suspicious_ips(high_volume_ips, sensitive_ips):
+    """Combine detected IPs and handle duplicates"""
+    all_ips = {}
+    
+    # Add high volume IPs
+    for ip_data in high_volume_ips:
+        ip_address = ip_data['ip_address']
+        all_ips[ip_address] = ip_data
+    
+    # Add sensitive access IPs; IPs with both were already saved as suspicious_pattern
+    for ip_data in sensitive_ips:
+        ip_address = ip_data['ip_address']
+        if ip_address in all_ips:
+            all_ips[ip_address] = {**all_ips[ip_address], 'reason': 'suspicious_pattern'}
+        else:
+            all_ips[ip_address] = ip_data
+    
+    return list(all_ips.values())
+
+@shared_task
+def auto_block_suspicious_ips():
+    """
+    Optional task to automatically block IPs that are repeatedly suspicious
+    """
+    threshold = 3  # Number of times IP must be flagged as suspicious
+    lookback_days = 7
+    
+    cutoff_time = timezone.now() - timedelta(days=lookback_days)
+    
+    repeat_offenders = (
+        SuspiciousIP.objects
+        .filter(detected_at__gte=cutoff_time, is_resolved=False)
+        .values('ip_address')
+        .annotate(suspicious_count=Count('id'))
+        .filter(suspicious_count__gte=threshold)
+    )
+    
+    blocked_count = 0
+    for offender in repeat_offenders:
+        ip_address = offender['ip_address']
+        suspicious_count = offender['suspicious_count']
+        
+        # Check if not already blocked
+        if not BlockedIP.objects.filter(ip_address=ip_address, prefix_length__isnull=True).exists():
+            BlockedIP.objects.create(
+                ip_address=ip_address,
+                reason=f"Automatically blocked: flagged as suspicious {suspicious_count} times in the last {lookback_days} days"
+            )
+            blocked_count += 1
+            logger.warning(f"Auto-blocked repeat offender: {ip_address}")
+    
+    return {'auto_blocked_count': blocked_count}
+
+@shared_task
+def cleanup_old_suspicious_ips():
+    """
+    Clean up resolved suspicious IP records older than 30 days
+    """
+    cutoff_time = timezone.now() - timedelta(days=30)
+    
+    # The post_delete signal of every row bumps the suspicious IP version once, at the end
+    with bump_suspicious_version.deferred():
+        deleted_count, _ = SuspiciousIP.objects.filter(
+            detected_at__lt=cutoff_time,
+            is_resolved=True
+        ).delete()
+    
+    logger.info(f"Cleaned up {deleted_count} old resolved suspicious IP records")
+    return {'cleaned_up_count': deleted_count}
+
+@shared_task
+def enrich_request_log_geolocation():
+    """
+    Backfill geolocation for RequestLog rows written without it.
+    Each pending IP is looked up once and all of its rows are updated together.
+    """
+    max_ips = getattr(settings, 'GEOLOCATION_ENRICHMENT', {}).get('MAX_IPS_PER_RUN', 500)
+    
+    pending_ips = list(
+        RequestLog.objects
+        .filter(geolocation_data__isnull=True)
+        .order_by()
+        .values_list('ip_address', flat=True)
+        .distinct()[:max_ips]
+    )
+    
+    geolocation = GeolocationService().get_geolocation_many(pending_ips)
+    updated_rows = 0
+    enriched_ips = 0
+    failed_ips = 0
+    counter_deltas = Counter()
+    
+    # Rows of hours rolled up while they waited are added to the country rollups
+    rolled_until = rollups.rolled_up_until()
+    late_rows = {}
+    if rolled_until is not None:
+        for (hour, ip_address), counts in rollups.hourly_counts(
+            RequestLog.objects.filter(
+                ip_address__in=pending_ips, geolocation_data__isnull=True, timestamp__lt=rolled_until
+            ),
+            'ip_address'
+        ).items():
+            late_rows.setdefault(ip_address, []).append((hour, counts))
+    rollup_deltas = {}
+    
+    for ip_address, geolocation_data in geolocation.items():
+        pending_rows = RequestLog.objects.filter(ip_address=ip_address, geolocation_data__isnull=True)
+        country = geolocation_data.get('country')
+        if geolocation_data.get('error') or not country:
+            # Only the payload is stored, so the rows are not retried forever and stay unlocated
+            failed_ips += 1
+            updated_rows += pending_rows.update(geolocation_data=geolocation_data)
+            continue
+        
+        enriched_ips += 1
+        updated = pending_rows.update(
+            country=country,
+            city=geolocation_data.get('city'),
+            region=geolocation_data.get('region'),
+            latitude=geolocation_data.get('latitude'),
+            longitude=geolocation_data.get('longitude'),
+            geolocation_data=geolocation_data
+        )
+        updated_rows += updated
+        
+        # The rows were counted in the totals when written; only their location is new
+        city = geolocation_data.get('city')
+        if updated:
+            counter_deltas[('country', country, '')] += updated
+            if city:
+                counter_deltas[('city', country, city)] += updated
+        for hour, (requests, sensitive) in late_rows.get(ip_address, ()):
+            total = rollup_deltas.get((hour, country), (0, 0))
+            rollup_deltas[(hour, country)] = (total[0] + requests, total[1] + sensitive)
+    
+    increment_counters(counter_deltas)
+    rollups.add_to_rollups(RequestLogHourlyCountry, 'country', rollup_deltas)
+    
+    logger.info(f"Geolocation enrichment updated {updated_rows} rows for {len(pending_ips)} IPs ({failed_ips} lookups failed)")
+    return {
+        'enriched_ips': enriched_ips,
+        'failed_ips': failed_ips,
+        'updated_rows': updated_rows
+    }
+
+@shared_task
+def rollup_request_logs():
+    """
+    Fold complete hours of RequestLog into the hourly per-IP and per-country rollups,
+    then check the newly rolled hours for sustained high volume
+    """
+    result = rollups.rollup_request_logs()
+    logger.info(f"Rolled up {result['rows_rolled_up']} request logs in {result['hours_rolled_up']} hours")
+    
+    result['sustained_volume_ips'] = 0
+    if result['hours_rolled_up']:
+        new_high_volume, _ = save_suspicious_ips(detect_sustained_volume_ips(), [])
+        result['sustained_volume_ips'] = len(new_high_volume)
+    return result
+
+@shared_task
+def prune_request_logs():
+    """
+    Delete raw request logs past the retention period, in small batches
+    """
+    result = rollups.prune_request_logs()
+    logger.info(f"Pruned {result['deleted_rows']} request logs and {result['deleted_rollups']} rollup rows")
+    return result
+
+@shared_task
+def rebuild_request_counters():
+    """
+    Recompute the request counters behind the home and stats views from RequestLog.
+    Not scheduled; run it once to seed counters for data logged before they existed.
+    """
+    counters = rebuild_counters()
+    logger.info(f"Rebuilt {counters} request counters")
+    return {'counters': counters}
\ No newline at end of file
@@ -5,6 +5,7 @@ urlpatterns = [
     path('', views.home, name='home'),
     path('logs/', views.view_logs, name='view_logs'),
     path('stats/', views.geolocation_stats, name='geolocation_stats'),  # Add this
+    path('metrics/', views.metrics_view, name='metrics'),
 
         # Rate limited endpoints
     path('login/', views.login_view, name='login'),
@@ -1,52 +1,142 @@
-from django.http import JsonResponse
+import hashlib
+import hmac
+import ipaddress
+import json
+from datetime import timedelta
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils import timezone
+from django.utils.http import http_date
+from .metrics import collect_metrics, get_metrics_settings, render_prometheus
 from .models import RequestLog
-from .rate_limits import rate_limit_authenticated, rate_limit_by_group
+from .rate_limits import rate_limit_policy
 from .models import SuspiciousIP
+from .pagination import keyset_page, parse_aware_datetime
+from .request_counters import get_geolocation_stats, get_total_requests, get_window_stats
+from .suspicious import get_suspicious_version
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth import authenticate, login
 
+# Cached pages are keyed by the SuspiciousIP version, so this only bounds how long unused ones linger
+SUSPICIOUS_IPS_CACHE_TIMEOUT = 300
+
 
 def home(request):
+    total_logs, counted_at = get_total_requests()
     return JsonResponse({
         'message': 'IP Tracking Project with Geolocation is working!',
-        'total_logs': RequestLog.objects.count(),
-        'your_ip': request.META.get('REMOTE_ADDR')
-          'user': str(request.user) if request.user.is_authenticated else 'Anonymous'
+        'total_logs': total_logs,
+        'total_logs_updated_at': counted_at,
+        'your_ip': request.META.get('REMOTE_ADDR'),
+        'user': str(request.user) if request.user.is_authenticated else 'Anonymous'
     })
 
+def serialize_log(log):
+    return {
+        'id': log.id,
+        'ip': log.ip_address, 
+        'path': log.path, 
+        'timestamp': str(log.timestamp),
+        'country': log.country,
+        'city': log.city,
+        'region': log.region,
+        'location': f"{log.city}, {log.country}" if log.city and log.country else "Unknown"
+    }
+
+def filter_logs(params):
+    """RequestLog queryset filtered by ip, path (prefix), country, since and until"""
+    logs = RequestLog.objects.only('id', 'ip_address', 'path', 'timestamp', 'country', 'city', 'region')
+    if params.get('ip'):
+        logs = logs.filter(ip_address=params['ip'])
+    if params.get('path'):
+        logs = logs.filter(path__startswith=params['path'])
+    if params.get('country'):
+        logs = logs.filter(country=params['country'])
+    if params.get('since'):
+        logs = logs.filter(timestamp__gte=parse_aware_datetime(params['since']))
+    if params.get('until'):
+        logs = logs.filter(timestamp__lt=parse_aware_datetime(params['until']))
+    return logs
+
 def view_logs(request):
-    logs = RequestLog.objects.all()[:10]  # Last 10 logs
-    log_data = [
-        {
-            'ip': log.ip_address, 
-            'path': log.path, 
-            'timestamp': str(log.timestamp),
-            'country': log.country,
-            'city': log.city,
-            'region': log.region,
-            'location': f"{log.city}, {log.country}" if log.city and log.country else "Unknown"
-        }
-        for log in logs
-    ]
-    return JsonResponse({'recent_logs': log_data})
+    """
+    Request logs, newest first. Filters: ip, path (prefix), country, since, until.
+    Pages are keyset-paginated on (timestamp, id): pass back next_cursor as ?cursor=.
+    ?format=ndjson streams every matching row instead of a page.
+    """
+    try:
+        logs = filter_logs(request.GET)
+        limit = min(int(request.GET.get('limit', 10)), 1000)
+        if limit < 1:
+            raise ValueError('limit must be positive')
+        
+        if request.GET.get('format') == 'ndjson':
+            rows = logs.order_by('-timestamp', '-id').iterator(chunk_size=2000)
+            return StreamingHttpResponse(
+                (json.dumps(serialize_log(log)) + '\n' for log in rows),
+                content_type='application/x-ndjson'
+            )
+        
+        page, next_cursor = keyset_page(logs, 'timestamp', request.GET.get('cursor'), limit)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({
+        'recent_logs': [serialize_log(log) for log in page],
+        'next_cursor': next_cursor
+    })
 
 def geolocation_stats(request):
-    """View to show geolocation statistics"""
-    stats = {
-        'total_requests': RequestLog.objects.count(),
-        'countries': list(RequestLog.objects.exclude(country__isnull=True)
-                          .values('country')
-                          .distinct()
-                          .count()),
-        'cities': list(RequestLog.objects.exclude(city__isnull=True)
-                       .values('city', 'country')
-                       .distinct()),
-        'requests_by_country': list(RequestLog.objects.exclude(country__isnull=True)
-                                   .values('country')
-                                   .annotate(count=models.Count('id'))
-                                   .order_by('-count')[:10])
-    }
-    return JsonResponse(stats)
+    """
+    View to show geolocation statistics, read from the running request counters.
+    ?hours=N reports the last N hours instead, from the hourly rollups.
+    """
+    if request.GET.get('hours'):
+        try:
+            hours = int(request.GET['hours'])
+            if hours < 1:
+                raise ValueError('hours must be positive')
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        return JsonResponse(get_window_stats(timezone.now() - timedelta(hours=hours)))
+    return JsonResponse(get_geolocation_stats())
+
+def metrics_access_allowed(request):
+    """
+    Staff users, requests bearing METRICS['TOKEN'], and clients connecting
+    from METRICS['ALLOWED_IPS']. Only REMOTE_ADDR is trusted here, since
+    X-Forwarded-For can be set by anyone.
+    """
+    if request.user.is_authenticated and request.user.is_staff:
+        return True
+
+    config = get_metrics_settings()
+    token = config['TOKEN']
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and authorization.startswith('Bearer ') and hmac.compare_digest(
+        authorization[len('Bearer '):].encode(), token.encode()
+    ):
+        return True
+
+    try:
+        client = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(
+        client in ipaddress.ip_network(allowed, strict=False)
+        for allowed in config['ALLOWED_IPS']
+    )
+
+
+def metrics_view(request):
+    """Latency histograms and counters in Prometheus text format, for allowed scrapers only"""
+    if not metrics_access_allowed(request):
+        return HttpResponseForbidden('Forbidden', content_type='text/plain; charset=utf-8')
+    return HttpResponse(
+        render_prometheus(collect_metrics()),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
 
 
 
@@ -59,7 +149,7 @@ def rate_limit_exceeded(request, exception):
     }, status=429)
 
 # Sensitive view with rate limiting for anonymous users
-@ratelimit(key='ip', rate='5/m', method='POST', block=True)
+@rate_limit_policy('login')
 @csrf_exempt
 def login_view(request):
     """Login view with rate limiting"""
@@ -92,7 +182,7 @@ def login_view(request):
     }, status=405)
 
 # View with different rate limits for authenticated vs anonymous users
-@ratelimit(key='user_or_ip', rate='10/m', method='POST', block=True)
+@rate_limit_policy('sensitive_operation')
 @csrf_exempt
 def sensitive_operation(request):
     """A view that performs sensitive operations with rate limiting"""
@@ -118,7 +208,7 @@ def sensitive_operation(request):
     }, status=405)
 
 # API endpoint with IP-based rate limiting
-@ratelimit(key='ip', rate='10/m', method='GET', block=True)
+@rate_limit_policy('api_endpoint')
 def api_endpoint(request):
     """API endpoint with IP-based rate limiting"""
     return JsonResponse({
@@ -128,8 +218,7 @@ def api_endpoint(request):
     })
 
 # View with method-specific rate limiting
-@ratelimit(key='ip', rate='20/m', method='GET')
-@ratelimit(key='ip', rate='5/m', method='POST', block=True)
+@rate_limit_policy('multi_method_view')
 @csrf_exempt
 def multi_method_view(request):
     """View with different rate limits for different HTTP methods"""
@@ -151,7 +240,7 @@ def multi_method_view(request):
 
 
 # View using custom authenticated rate limiting
-@rate_limit_authenticated(rate='10/m')
+@rate_limit_policy('auth_sensitive')
 @csrf_exempt
 def authenticated_sensitive_view(request):
     """View with automatic rate limiting based on authentication"""
@@ -168,7 +257,7 @@ def authenticated_sensitive_view(request):
         })
 
 # View with group-based rate limiting
-@rate_limit_by_group('api', '100/h')
+@rate_limit_policy('high_api')
 def high_limit_api(request):
     """API endpoint with higher rate limit"""
     return JsonResponse({
@@ -176,7 +265,7 @@ def high_limit_api(request):
         'rate_limit': '100 requests per hour'
     })
 
-@rate_limit_by_group('sensitive', '10/m')
+@rate_limit_policy('low_sensitive')
 def low_limit_sensitive(request):
     """Sensitive endpoint with lower rate limit"""
     return JsonResponse({
@@ -185,23 +274,82 @@ def low_limit_sensitive(request):
     })
 
 
+def serialize_suspicious_ip(ip):
+    return {
+        'id': ip.id,
+        'ip_address': ip.ip_address,
+        'reason': ip.reason,
+        'reason_display': ip.get_reason_display(),
+        'description': ip.description,
+        'request_count': ip.request_count,
+        'detected_at': str(ip.detected_at),
+        'is_resolved': ip.is_resolved,
+    }
+
+def filter_suspicious_ips(params):
+    """SuspiciousIP queryset filtered by state (active, resolved, all), reason (comma separated), since and until"""
+    suspicious_ips = SuspiciousIP.objects.all()
+    state = params.get('state', 'active')
+    if state not in ('active', 'resolved', 'all'):
+        raise ValueError('state must be active, resolved or all')
+    if state != 'all':
+        suspicious_ips = suspicious_ips.filter(is_resolved=state == 'resolved')
+    if params.get('reason'):
+        reasons = params['reason'].split(',')
+        unknown = set(reasons) - {value for value, _ in SuspiciousIP.REASON_CHOICES}
+        if unknown:
+            raise ValueError(f"Unknown reason: {', '.join(sorted(unknown))}")
+        suspicious_ips = suspicious_ips.filter(reason__in=reasons)
+    if params.get('since'):
+        suspicious_ips = suspicious_ips.filter(detected_at__gte=parse_aware_datetime(params['since']))
+    if params.get('until'):
+        suspicious_ips = suspicious_ips.filter(detected_at__lt=parse_aware_datetime(params['until']))
+    return suspicious_ips
+
 def suspicious_ips_view(request):
-    """View to see currently suspicious IPs"""
-    suspicious_ips = SuspiciousIP.objects.filter(is_resolved=False)
-    
-    ip_data = [
-        {
-            'ip_address': ip.ip_address,
-            'reason': ip.reason,
-            'reason_display': ip.get_reason_display(),
-            'description': ip.description,
-            'request_count': ip.request_count,
-            'detected_at': str(ip.detected_at),
+    """
+    Suspicious IPs, newest first. Filters: state (active by default, resolved, all),
+    reason (comma separated), since, until. Pages are keyset-paginated on
+    (detected_at, id): pass back next_cursor as ?cursor=. total_count is only
+    included on the first page.
+
+    Responses are cached per SuspiciousIP version and carry an ETag and
+    Last-Modified, so a poller revalidating an unchanged list gets a 304
+    after a single cache read.
+    """
+    token, changed_at = get_suspicious_version()
+    etag = f'"{token}"'
+    last_modified = int(changed_at)
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
+
+    params = sorted(request.GET.lists())
+    cache_key = 'suspicious_ips_view_' + hashlib.md5(f'{token}:{params}'.encode()).hexdigest()
+    content = cache.get(cache_key)
+    if content is None:
+        try:
+            suspicious_ips = filter_suspicious_ips(request.GET)
+            limit = min(int(request.GET.get('limit', 50)), 1000)
+            if limit < 1:
+                raise ValueError('limit must be positive')
+            cursor = request.GET.get('cursor')
+            page, next_cursor = keyset_page(suspicious_ips, 'detected_at', cursor, limit)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+        data = {
+            'suspicious_ips': [serialize_suspicious_ip(ip) for ip in page],
+            'next_cursor': next_cursor,
         }
-        for ip in suspicious_ips
-    ]
-    
-    return JsonResponse({
-        'suspicious_ips': ip_data,
-        'total_count': suspicious_ips.count()
-    })
\ No newline at end of file
+        if not cursor:
+            data['total_count'] = suspicious_ips.count() if next_cursor else len(page)
+        content = json.dumps(data)
+        cache.set(cache_key, content, SUSPICIOUS_IPS_CACHE_TIMEOUT)
+
+    response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients keep the body but revalidate it on every poll
+    patch_cache_control(response, no_cache=True)
+    return response
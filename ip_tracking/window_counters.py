@@ -0,0 +1,196 @@
+import collections
+import threading
+import time
+
+from django.conf import settings
+
+from .path_classifier import SensitivePathMatcher
+from .worker_snapshots import worker_publisher
+
+
+def get_window_settings():
+    """Sliding-window counter settings from ANOMALY_DETECTION, with defaults applied"""
+    config = {
+        'WINDOW_COUNTERS': True,
+        'WINDOW_SECONDS': 3600,
+        'COUNTER_BUCKET_SECONDS': 60,
+        'COUNTER_PUBLISH_INTERVAL': 5,
+        'COUNTER_PUBLISH_MIN_REQUESTS': 10,
+        'COUNTER_PUBLISH_MAX_BYTES': 256 * 1024,
+        'MAX_TRACKED_IPS': 50000,
+        'MAX_PATHS_PER_IP': 20,
+        'SENSITIVE_PATHS': [],
+    }
+    config.update(getattr(settings, 'ANOMALY_DETECTION', {}))
+    return config
+
+
+class SlidingWindowCounters:
+    """
+    Per-IP request and sensitive-path counts over a sliding window,
+    kept in time buckets so old traffic can be subtracted as it ages out.
+
+    Recording a request is O(1): it bumps the current bucket and a running
+    per-IP total. Whole buckets are subtracted from the totals once they
+    leave the window, so reading the window never rescans anything.
+    Memory is bounded by MAX_TRACKED_IPS; requests from IPs beyond that
+    are counted in ``overflow`` instead.
+
+    Each process publishes its totals to the shared cache every
+    COUNTER_PUBLISH_INTERVAL seconds; collect_window_counters() merges them.
+    Only IPs detection can act on are published: those with at least
+    publish_min_requests requests in this process, or any sensitive request,
+    most sensitive requests first, then busiest, until the estimated size
+    reaches publish_max_bytes.
+    """
+
+    def __init__(self, window_seconds=3600, bucket_seconds=60, sensitive_paths=(),
+                 max_ips=50000, max_paths_per_ip=20, publish_interval=5,
+                 publish_min_requests=10, publish_max_bytes=256 * 1024):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.buckets_per_window = max(1, window_seconds // bucket_seconds)
+        self.path_matcher = SensitivePathMatcher(sensitive_paths)
+        self.max_ips = max_ips
+        self.max_paths_per_ip = max_paths_per_ip
+        self.publish_interval = publish_interval
+        self.publish_min_requests = publish_min_requests
+        self.publish_max_bytes = publish_max_bytes
+
+        self._buckets = collections.OrderedDict()  # bucket -> {ip: [requests, sensitive, {path: count}]}
+        self._totals = {}
+        self._lock = threading.Lock()
+        self.overflow = 0
+        self.omitted = 0  # IPs left out of the last snapshot by the byte limit
+        self.publisher = worker_publisher.register('anomaly_window', self.snapshot, publish_interval, on_fork=self._reset)
+
+    def is_sensitive(self, path):
+        return self.path_matcher.is_sensitive(path)
+
+    def record(self, ip_address, path, sensitive=None, now=None):
+        """Count one request; sensitivity is derived from the path unless given"""
+        if sensitive is None:
+            sensitive = self.is_sensitive(path)
+        bucket = int((now or time.time()) // self.bucket_seconds)
+
+        self.publisher.ensure_started()
+        with self._lock:
+            self._expire(bucket)
+
+            total = self._totals.get(ip_address)
+            if total is None:
+                if len(self._totals) >= self.max_ips:
+                    self.overflow += 1
+                    return
+                total = self._totals[ip_address] = [0, 0, {}]
+
+            counts = self._buckets.get(bucket)
+            if counts is None:
+                counts = self._buckets[bucket] = {}
+            entry = counts.get(ip_address)
+            if entry is None:
+                entry = counts[ip_address] = [0, 0, {}]
+
+            entry[0] += 1
+            total[0] += 1
+            if sensitive:
+                entry[1] += 1
+                total[1] += 1
+                if path in total[2] or len(total[2]) < self.max_paths_per_ip:
+                    entry[2][path] = entry[2].get(path, 0) + 1
+                    total[2][path] = total[2].get(path, 0) + 1
+
+    def _expire(self, current_bucket):
+        oldest = current_bucket - self.buckets_per_window + 1
+        while self._buckets:
+            bucket = next(iter(self._buckets))
+            if bucket >= oldest:
+                break
+            counts = self._buckets.pop(bucket)
+            for ip_address, (requests, sensitive, paths) in counts.items():
+                total = self._totals[ip_address]
+                total[0] -= requests
+                total[1] -= sensitive
+                for path, count in paths.items():
+                    remaining = total[2][path] - count
+                    if remaining > 0:
+                        total[2][path] = remaining
+                    else:
+                        del total[2][path]
+                if total[0] <= 0:
+                    del self._totals[ip_address]
+
+    def snapshot(self, now=None):
+        """{ip: {'requests': n, 'sensitive': n, 'paths': {path: n}}} for the published part of the window"""
+        bucket = int((now or time.time()) // self.bucket_seconds)
+        with self._lock:
+            self._expire(bucket)
+            entries = [
+                (ip_address, requests, sensitive, dict(paths))
+                for ip_address, (requests, sensitive, paths) in self._totals.items()
+                if requests >= self.publish_min_requests or sensitive
+            ]
+
+        # Rough pickled size: the address, two counts and each path with its count
+        sizes = [
+            len(ip_address) + 24 + sum(len(path) + 12 for path in paths)
+            for ip_address, _, _, paths in entries
+        ]
+        if sum(sizes) > self.publish_max_bytes:
+            order = sorted(range(len(entries)), key=lambda index: (-entries[index][2], -entries[index][1]))
+            kept = []
+            used = 0
+            for index in order:
+                if used + sizes[index] > self.publish_max_bytes:
+                    break
+                used += sizes[index]
+                kept.append(entries[index])
+            self.omitted = len(entries) - len(kept)
+            entries = kept
+        else:
+            self.omitted = 0
+
+        return {
+            ip_address: {'requests': requests, 'sensitive': sensitive, 'paths': paths}
+            for ip_address, requests, sensitive, paths in entries
+        }
+
+    def publish(self):
+        self.publisher.publish()
+
+    def _reset(self):
+        # Counts copied from the parent belong to the parent
+        with self._lock:
+            self._buckets.clear()
+            self._totals.clear()
+
+
+def collect_window_counters():
+    """
+    Merge the published windows of every live process into
+    {ip: {'requests': n, 'sensitive': n, 'paths': {path: n}}}.
+    """
+    merged = {}
+    for snapshot in window_counters.publisher.collect():
+        for ip_address, counts in snapshot.items():
+            total = merged.setdefault(ip_address, {'requests': 0, 'sensitive': 0, 'paths': {}})
+            total['requests'] += counts['requests']
+            total['sensitive'] += counts['sensitive']
+            for path, count in counts['paths'].items():
+                total['paths'][path] = total['paths'].get(path, 0) + count
+    return merged
+
+
+_config = get_window_settings()
+
+# Shared by every IPLoggingMiddleware instance in this process
+window_counters = SlidingWindowCounters(
+    window_seconds=_config['WINDOW_SECONDS'],
+    bucket_seconds=_config['COUNTER_BUCKET_SECONDS'],
+    sensitive_paths=_config['SENSITIVE_PATHS'],
+    max_ips=_config['MAX_TRACKED_IPS'],
+    max_paths_per_ip=_config['MAX_PATHS_PER_IP'],
+    publish_interval=_config['COUNTER_PUBLISH_INTERVAL'],
+    publish_min_requests=_config['COUNTER_PUBLISH_MIN_REQUESTS'],
+    publish_max_bytes=_config['COUNTER_PUBLISH_MAX_BYTES'],
+)
@@ -0,0 +1,148 @@
+"""
+Per-process state shared through the cache.
+
+Window counters, metrics and the rate-limit index are kept in each worker's
+memory. Each registers a snapshot source with the process's WorkerPublisher,
+whose single background thread copies every source to the shared cache
+under '{name}_{worker id}' when its interval comes round.
+
+Live workers are found without a shared list: each worker holds one of
+MAX_WORKERS slot keys, claimed with an atomic cache.add() and kept alive by
+every publish, so concurrent workers never overwrite each other's
+registration. collect() reads the slots, then every live worker's snapshot,
+with two get_many calls, so readers never scan the cache.
+"""
+import os
+import socket
+import threading
+import time
+import zlib
+
+from django.core.cache import cache
+
+WORKER_SLOT_KEY = 'ip_tracking_worker_slot_{}'
+MAX_WORKERS = 256
+
+
+def get_worker_id():
+    return f"{socket.gethostname()}_{os.getpid()}"
+
+
+class SnapshotSource:
+    """One registered snapshot; publish() and collect() act on this name only"""
+
+    def __init__(self, publisher, name, snapshot, interval, on_fork=None):
+        self.publisher = publisher
+        self.name = name
+        self.snapshot = snapshot
+        self.interval = interval
+        self.on_fork = on_fork
+        self.next_publish = 0.0
+
+    def snapshot_key(self, worker_id=None):
+        return f"{self.name}_{worker_id or get_worker_id()}"
+
+    def ensure_started(self):
+        self.publisher.ensure_started()
+
+    def publish(self):
+        """Store this process's snapshot in the shared cache now"""
+        self.publisher.publish([self])
+
+    def collect(self):
+        """Snapshots this source published in every live worker"""
+        return self.publisher.collect(self)
+
+
+class WorkerPublisher:
+    """
+    Publishes every registered source from one daemon thread per process,
+    started by the first ensure_started() in each process. After a fork the
+    child calls every source's on_fork() first, so state copied from the
+    parent is not published twice, and claims a slot of its own.
+    """
+
+    def __init__(self):
+        self.sources = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._slot = None
+
+    def register(self, name, snapshot, interval, on_fork=None):
+        source = SnapshotSource(self, name, snapshot, interval, on_fork)
+        self.sources.append(source)
+        return source
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            if self._pid is not None:
+                for source in self.sources:
+                    if source.on_fork is not None:
+                        source.on_fork()
+            self._pid = os.getpid()
+            self._slot = None
+            self._thread = threading.Thread(target=self._run, name='worker-snapshot-publisher', daemon=True)
+            self._thread.start()
+
+    def slot_timeout(self):
+        return max(source.interval for source in self.sources) * 4
+
+    def publish(self, sources):
+        """Write the sources' snapshots with one set_many per interval, then keep the slot alive"""
+        worker_id = get_worker_id()
+        by_timeout = {}
+        for source in sources:
+            by_timeout.setdefault(source.interval * 4, {})[source.snapshot_key(worker_id)] = source.snapshot()
+        for timeout, snapshots in by_timeout.items():
+            cache.set_many(snapshots, timeout)
+        self._keep_slot(worker_id)
+
+    def _keep_slot(self, worker_id):
+        timeout = self.slot_timeout()
+        if self._slot is not None:
+            key = WORKER_SLOT_KEY.format(self._slot)
+            owner = cache.get(key)
+            if owner == worker_id:
+                cache.touch(key, timeout)
+                return
+            if owner is None and cache.add(key, worker_id, timeout):
+                return
+
+        # Start from a slot derived from the worker id, so workers rarely contend
+        start = zlib.crc32(worker_id.encode()) % MAX_WORKERS
+        for offset in range(MAX_WORKERS):
+            slot = (start + offset) % MAX_WORKERS
+            if cache.add(WORKER_SLOT_KEY.format(slot), worker_id, timeout):
+                self._slot = slot
+                return
+        self._slot = None
+        print(f"No free worker slot for {worker_id}; its snapshots are not collected")
+
+    def collect(self, source):
+        """Snapshots published under source's name by every worker holding a slot"""
+        slots = cache.get_many([WORKER_SLOT_KEY.format(slot) for slot in range(MAX_WORKERS)])
+        keys = [source.snapshot_key(worker_id) for worker_id in set(slots.values())]
+        return list(cache.get_many(keys).values())
+
+    def _run(self):
+        while True:
+            now = time.monotonic()
+            due = [source for source in self.sources if source.next_publish <= now]
+            for source in due:
+                source.next_publish = now + source.interval
+            try:
+                if due:
+                    self.publish(due)
+            except Exception as e:
+                print(f"Error publishing worker snapshots: {e}")
+            wake = min(source.next_publish for source in self.sources)
+            time.sleep(max(0.1, wake - time.monotonic()))
+
+
+# Shared by every per-process snapshot source
+worker_publisher = WorkerPublisher()
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 
+from celery.schedules import crontab
+
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -53,7 +55,46 @@ CELERY_TIMEZONE = 'UTC'
 ANOMALY_DETECTION = {
     'REQUESTS_PER_HOUR_THRESHOLD': 100,
     'SENSITIVE_PATHS': ['/admin', '/login', '/sensitive', '/api'],
-    'CHECK_INTERVAL_HOURS': 1,
+    'CHECK_INTERVAL_SECONDS': 15,  # Detection reads the counters below, so it can run often
+    # Per-IP sliding-window counters maintained at ingest
+    'WINDOW_COUNTERS': True,
+    'WINDOW_SECONDS': 3600,
+    'COUNTER_BUCKET_SECONDS': 60,
+    'COUNTER_PUBLISH_INTERVAL': 5,  # Seconds between publishing each worker's counts to the cache
+    'MAX_TRACKED_IPS': 50000,  # Per worker; further new IPs are not counted
+    # Each worker publishes only IPs with this many requests, or any sensitive one,
+    # sensitive then busiest first, up to about this many bytes per snapshot
+    'COUNTER_PUBLISH_MIN_REQUESTS': 10,
+    'COUNTER_PUBLISH_MAX_BYTES': 256 * 1024,
+    'MAX_PATHS_PER_IP': 20,  # Distinct sensitive paths remembered per IP
+    # Sustained volume over a longer window, checked by the rollup task from the hourly rollups
+    'LONG_WINDOW_HOURS': 24,
+    'REQUESTS_PER_LONG_WINDOW_THRESHOLD': 1000,
+}
+
+# IP Blocklist Settings
+IP_BLOCKLIST = {
+    'REFRESH_INTERVAL': 5,  # Seconds between checks of the shared blocklist version
+}
+
+# Request Log Writer Settings
+REQUEST_LOG_WRITER = {
+    'ENABLED': True,
+    'BATCH_SIZE': 500,  # Rows per bulk insert
+    'FLUSH_INTERVAL': 2.0,  # Seconds between background flushes
+    'MAX_BUFFER': 10000,  # Rows kept in memory before new rows are dropped
+}
+
+# Request log rollups and retention
+REQUEST_LOG_RETENTION = {
+    'RAW_DAYS': 30,  # Raw rows older than this are deleted once rolled up
+    'ROLLUP_DAYS': 365,  # Hourly rollups are kept this long
+    'ROLLUP_GRACE_MINUTES': 10,  # Wait this long after an hour ends before rolling it up
+    'ENRICHMENT_WAIT_MINUTES': 60,  # Longest an hour waits for its rows' geolocation before it is rolled up
+    'MAX_HOURS_PER_RUN': 48,
+    'DELETE_BATCH_SIZE': 2000,  # Rows per delete transaction
+    'MAX_DELETE_BATCHES': 500,  # Per task run
+    'DELETE_PAUSE': 0.05,  # Seconds between delete batches, so writers get the lock
 }
 
 # IP Geolocation Settings
@@ -62,6 +103,38 @@ IPGEOLOCATION_SETTINGS = {
     'BACKEND_API_KEY': '',  # We'll use the free tier which doesn't require API key
     'BACKEND_TIMEOUT': 5,  # Timeout in seconds
     'BACKEND_CACHE_TTL': 86400,  # Cache for 24 hours (in seconds)
+    # Compiled range database, built with `manage.py compile_geoip_db`
+    'LOCAL_DATABASE': BASE_DIR / 'geoip' / 'ip_ranges.bin',
+    'LOCAL_DATABASE_CHECK_INTERVAL': 30,  # Seconds between checks for a recompiled database file
+    # Single-flight lookups: lock lifetime and how long other callers wait for it
+    'LOOKUP_LOCK_TIMEOUT': 15,
+    'LOOKUP_WAIT_TIMEOUT': 12,
+    'NEGATIVE_CACHE_TTL': 300,  # Seconds to remember that every provider failed
+    # Skip a provider for COOLDOWN seconds after this many consecutive failures
+    'CIRCUIT_BREAKER_FAILURES': 5,
+    'CIRCUIT_BREAKER_COOLDOWN': 60,
+    'BATCH_SIZE': 100,  # IPs per call to batch endpoints (ip-api.com allows 100)
+    'HTTP_POOL_SIZE': 10,  # Keep-alive connections per provider
+    # Per-process LRU in front of the shared cache
+    'LOCAL_CACHE_SIZE': 10000,
+    'LOCAL_CACHE_TTL': 3600,
+    'LOCAL_CACHE_JITTER': 0.1,  # Expiry is shortened by up to this fraction
+}
+
+# Deferred geolocation enrichment of RequestLog rows
+GEOLOCATION_ENRICHMENT = {
+    'MAX_IPS_PER_RUN': 500,  # Distinct IPs looked up per task run
+}
+
+# Latency histograms and counters served at /metrics/ in Prometheus format
+METRICS = {
+    'ENABLED': True,
+    'AGGREGATE_PROCESSES': False,  # True: every worker publishes to the cache and /metrics/ merges them
+    'PUBLISH_INTERVAL': 10,  # Seconds between publishes when aggregating
+    # Who may read /metrics/ besides staff users: scrapers connecting from these
+    # addresses or CIDRs, or sending 'Authorization: Bearer <TOKEN>'
+    'ALLOWED_IPS': ['127.0.0.1', '::1'],
+    'TOKEN': None,
 }
 
 # Cache configuration (using database cache for simplicity)
@@ -88,6 +161,41 @@ ROOT_URLCONF = 'ip_tracking_project.urls'
 # Rate limiting configuration
 RATELIMIT_VIEW = 'ip_tracking.views.rate_limit_exceeded'
 
+# Built-in rate limit engine (ip_tracking.rate_limits)
+RATE_LIMITS = {
+    # 'local' (per process), 'shared_memory' (every worker on this host, no I/O),
+    # 'cache' (shared Django cache) or 'redis'
+    'STORE': 'shared_memory',
+    'ALGORITHM': 'sliding_window',  # Or 'token_bucket' (not with the cache store)
+    'KEY_PREFIX': 'rl',
+    'REDIS_URL': 'redis://localhost:6379/0',
+    'SHARED_MEMORY_SLOTS': 65536,  # Fixed-size table (2.5 MB); expired slots are reused, live ones never
+    'WHEN_STORE_FULL': 'allow',  # Or 'deny': new keys that find no free slot (ip_tracking_rate_limit_store_full_total)
+    'HEADERS': True,  # Send RateLimit-Limit/-Remaining/-Reset/-Policy headers
+    'INDEX_MAX_KEYS': 10000,  # Active keys each worker remembers for rate_limit_status
+    'INDEX_TOP_KEYS': 100,  # Most throttled keys per group each worker publishes
+}
+
+# Per-view limits, keyed by route name (or a group shared by several views).
+# Each entry is a rule or a list of rules: rate, key ('ip', 'user', 'user_or_ip',
+# 'user_or_ip_key' or a dotted path), methods, block, users ('authenticated' or
+# 'anonymous'), group and algorithm. Compiled once when the views are imported.
+RATE_LIMIT_POLICIES = {
+    'login': {'rate': '5/m', 'key': 'ip', 'methods': ['POST']},
+    'sensitive_operation': {'rate': '10/m', 'key': 'user_or_ip', 'methods': ['POST']},
+    'api_endpoint': {'rate': '10/m', 'key': 'ip', 'methods': ['GET']},
+    'multi_method_view': [
+        {'rate': '20/m', 'key': 'ip', 'methods': ['GET'], 'block': False},
+        {'rate': '5/m', 'key': 'ip', 'methods': ['POST']},
+    ],
+    'auth_sensitive': [
+        {'rate': '10/m', 'key': 'user', 'users': 'authenticated'},
+        {'rate': '5/m', 'key': 'ip', 'users': 'anonymous'},
+    ],
+    'high_api': {'rate': '100/h', 'key': 'ip', 'group': 'api'},
+    'low_sensitive': {'rate': '10/m', 'key': 'ip', 'group': 'sensitive'},
+}
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
@@ -160,14 +268,26 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Celery Beat Schedule
 CELERY_BEAT_SCHEDULE = {
-    'detect-suspicious-ips-hourly': {
+    'detect-suspicious-ips': {
         'task': 'ip_tracking.tasks.detect_suspicious_ips',
-        'schedule': crontab(minute=0),  # Run every hour at :00
+        'schedule': ANOMALY_DETECTION['CHECK_INTERVAL_SECONDS'],  # Sliding window over the last hour
     },
     'auto-block-repeat-offenders-daily': {
         'task': 'ip_tracking.tasks.auto_block_suspicious_ips',
         'schedule': crontab(hour=2, minute=0),  # Run daily at 2:00 AM
     },
+    'enrich-request-log-geolocation': {
+        'task': 'ip_tracking.tasks.enrich_request_log_geolocation',
+        'schedule': crontab(),  # Run every minute
+    },
+    'rollup-request-logs': {
+        'task': 'ip_tracking.tasks.rollup_request_logs',
+        'schedule': crontab(minute='*/10'),  # Run every 10 minutes
+    },
+    'prune-request-logs-daily': {
+        'task': 'ip_tracking.tasks.prune_request_logs',
+        'schedule': crontab(hour=4, minute=0),  # Run daily at 4:00 AM
+    },
     'cleanup-old-records-weekly': {
         'task': 'ip_tracking.tasks.cleanup_old_suspicious_ips',
         'schedule': crontab(day_of_week=0, hour=3, minute=0),  # Run weekly on Sunday at 3:00 AM